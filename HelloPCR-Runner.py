@@ -1,15 +1,31 @@
 import sys
+import time
+import socket
 import struct 
 import argparse
 import traceback
 from src.common import *
-from socketserver import TCPServer, BaseRequestHandler
+from socketserver import ThreadingTCPServer, BaseRequestHandler
 import threading 
 # Parsing args
 parser = argparse.ArgumentParser()
 
 parser.add_argument('-e', '-E', '--emulate', dest='EMULATOR', action="store_true", help='emulator mode')
+parser.add_argument('--emulate-pipeline', dest='emulate_pipeline', action="store_true", help='emulator mode running the shot pipeline on synthesized frames')
+parser.add_argument('--time-scale', dest='time_scale', type=float, default=1.0, help='emulator time ratio (0.001 : 2s exposure in 2ms)')
+parser.add_argument('-b', '--batch-shot', dest='batch_shot', action="store_true", help='one capture for every channel of a cycle')
+parser.add_argument('-s', '--settle', dest='settle', action="store_true", help='capture as soon as camera frames are settled')
+parser.add_argument('-f', '--image-format', dest='image_format', choices=ARCHIVE_FORMATS, default=ARCHIVE_FORMAT, help='image archive format')
 parser.add_argument('-p', '--port', dest='port',type=int, help='TCP port number', default=48888)
+parser.add_argument('-c', '--max-connections', dest='max_connections', type=int, help='max TCP client connections', default=MAX_CONNECTIONS)
+parser.add_argument('--camera', dest='camera', choices=CAMERA_BACKENDS, default=CAMERA_BACKEND, help='camera backend')
+parser.add_argument('--camera-source', dest='camera_source', type=str, default=None, help='v4l2 device, replay video/Record folder')
+parser.add_argument('--camera-fps', dest='camera_fps', type=float, default=REPLAY_FPS, help='replay frame rate')
+parser.add_argument('--raw-capture', dest='raw_capture', action='store_true', help='raw camera frames, only the ROI is converted')
+parser.add_argument('--camera-raw-format', dest='camera_raw_format', choices=RAW_FORMATS, default=None, help='replay frames as raw frames of this format')
+parser.add_argument('--metrics-log', dest='metrics_log', action='store_true', help='stage timings of every shot in Record/<serial>/%s' % METRICS_LOG_NAME)
+parser.add_argument('--sync-log', dest='sync_log', action='store_true', help='write log records in the logging thread (no log queue)')
+parser.add_argument('--serial-port', dest='serial_port', type=str, default=None, help='serial port, skip device discovery')
 parser.add_argument('serial', type=str, help='serial number')
 
 args = parser.parse_args()
@@ -21,8 +37,9 @@ if len(args.serial) != 5:
 SERIAL_NUMBER = 'HelloPCR%s' %args.serial
 
 # Setup logger
-from src.logger import set_loggers, server_logger
-set_loggers(SERIAL_NUMBER)
+from src.logger import set_loggers, stop_loggers, get_log_stats, server_logger
+from src.metrics import metrics
+set_loggers(SERIAL_NUMBER, queued=not args.sync_log)
 
 # Server ip & port declares
 HOST = '127.0.0.1'
@@ -36,16 +53,32 @@ def init_device():
     global error_code, error_message
     try:
         serial_task, shot_worker = None, None
-        if args.EMULATOR:
+        if args.EMULATOR or args.emulate_pipeline:
             from emulator.shot_worker import ShotEmulator
             from emulator.serial_task import SerialEmulator, DeviceState
             serial_task = SerialEmulator()
-            shot_worker = ShotEmulator()
+            if args.emulate_pipeline:
+                from emulator.pipeline import PipelineEmulator
+                shot_worker = PipelineEmulator(serial_number=SERIAL_NUMBER, serial_task=serial_task, 
+                                               batch_shot=args.batch_shot, settle=args.settle, 
+                                               archive_format=args.image_format, metrics_log=args.metrics_log)
+            else:
+                shot_worker = ShotEmulator(serial_task=serial_task, settle=args.settle, time_scale=args.time_scale)
         else:
             from src.shot_worker import ShotWorker
             from src.serial_task import SerialTask
-            serial_task = SerialTask(serial_number=SERIAL_NUMBER)
-            shot_worker = ShotWorker(serial_number=SERIAL_NUMBER, serial_task=serial_task)
+            from src.camera_backend import open_backend
+            serial_task = SerialTask(serial_number=SERIAL_NUMBER, port=args.serial_port)
+            try:
+                camera_backend = open_backend(args.camera, SERIAL_NUMBER, args.camera_source, args.camera_fps, 
+                                              args.camera_raw_format)
+            except Exception as e:
+                server_logger.error(f'Cannot open camera backend {args.camera} : {e}')
+                raise CameraNotDetectedError()
+            shot_worker = ShotWorker(serial_number=SERIAL_NUMBER, serial_task=serial_task, 
+                                     batch_shot=args.batch_shot, settle=args.settle, 
+                                     archive_format=args.image_format, camera_backend=camera_backend,
+                                     raw_capture=args.raw_capture, metrics_log=args.metrics_log)
         shot_worker.start()
         return serial_task, shot_worker
     except SerialNotDetectedError as e:
@@ -65,12 +98,53 @@ def init_device():
     return None, None
 
 serial_task, shot_worker = init_device()
+
+class RunnerServer(ThreadingTCPServer):
+    """ Threaded TCP server, clients share serial_task & shot_worker under device_lock """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler, max_connections:int=MAX_CONNECTIONS):
+        ThreadingTCPServer.__init__(self, server_address, handler)
+        self.max_connections = max_connections
+        self.connections = 0
+        self.connection_lock = threading.Lock()
+        self.device_lock = threading.RLock()
+        self.terminated = False
+        self.ready_pending = False # first client connected, set device state READY
+        self.sequence_owner = None # handler waiting a SHOT_SEQUENCE, device_lock is released meanwhile
+
+    def verify_request(self, request, client_address):
+        with self.connection_lock:
+            if self.terminated or self.connections >= self.max_connections:
+                server_logger.info(f'refused connection {client_address}, connections : {self.connections}')
+                return False
+            self.connections += 1
+            if self.connections == 1: self.ready_pending = True
+        server_logger.info(f'connected {client_address}, connections : {self.connections}')
+        return True
+
+    def disconnected(self) -> bool:
+        """ Return True when the last connection is closed """
+        with self.connection_lock:
+            self.connections -= 1
+            return self.connections == 0
+
+    def terminate(self, message:str):
+        """ Stop serve_forever (called from a handler thread) """
+        with self.connection_lock:
+            if self.terminated: return
+            self.terminated = True
+        server_logger.info(message)
+        self.shutdown()
+
 class CommandHandler(BaseRequestHandler):
     def command_handler(self, command:int, filter_index:int, 
-                        current_cycle:int, experiment_date:str):
+                        current_cycle:int, experiment_date:str, 
+                        burst_frames:int=0, burst_method:int=0, sequence:list=None):
         global server_running
         global error_code, error_message
-        intensity = -1
+        intensity, intensities = -1, []
         try:
             if command == Command.EXIT: 
                 server_logger.info('server recv exit command')
@@ -79,8 +153,24 @@ class CommandHandler(BaseRequestHandler):
             elif command == Command.STATUS: 
                 serial_task.get_excitation_led()
                 intensity = shot_worker.get_intensity()
+            elif command == Command.STATUS_EX:
+                serial_task.get_excitation_led()
+                intensities = shot_worker.get_intensities()
+                intensity = shot_worker.get_intensity()
             elif command == Command.SHOT:
-                shot_worker.shot(filter_index, current_cycle, experiment_date)
+                shot_worker.shot(filter_index, current_cycle, experiment_date, burst_frames, burst_method)
+            elif command == Command.SHOT_SEQUENCE:
+                shot_worker.shot_sequence(sequence, current_cycle, experiment_date, burst_frames, burst_method)
+                # other clients poll STATUS while the sequence runs, other commands are replied busy
+                self.server.sequence_owner = self
+                self.server.device_lock.release()
+                try:
+                    self.sequence_result = shot_worker.wait_sequence(SEQUENCE_TIMEOUT)
+                finally:
+                    self.server.device_lock.acquire()
+                    self.server.sequence_owner = None
+                intensities = self.sequence_result['intensities']
+                intensity = intensities[-1]
             elif command in [ Command.OFF, Command.READY, Command.RUN, Command.ERROR ]:
                 serial_task.set_device_state(INDICATOR[command])
             else: raise CommandNotDefinedError("")
@@ -107,25 +197,179 @@ class CommandHandler(BaseRequestHandler):
         finally:
             if error_code not in [ErrorCode._, ErrorCode.SerialError]:
                 serial_task.set_device_state(DeviceState.ERROR)
-            return intensity
+            return intensity, intensities
+    
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.request.makefile('rb') # buffered, pipelined commands are read in one recv
+        self.send_lock = threading.Lock()          # replies & pushed events
+        self.subscribed = False
+        self.pusher = None
+        self.sequence_result = None
+
+    def finish(self):
+        self.rfile.close()
+
+    def recv_exact(self, size:int) -> bytes:
+        """ Read exactly `size` bytes, empty bytes when the connection is broken """
+        data = self.rfile.read(size)
+        return data if len(data) == size else b''
+
+    def recv_command(self):
+        """ Read a command of the negotiated protocol, None when the connection is broken """
+        request_id = None
+        if self.protocol == 1:
+            raw_data = self.recv_exact(BUFFER_SIZE)
+            if len(raw_data) == 0: return None
+            command, filter_index, current_cycle, experiment_date, burst_frames, burst_method, payload = struct.unpack(PACKET_FORMAT, raw_data)
+        else:
+            header = self.recv_exact(struct.calcsize(FRAME_HEADER_FORMAT))
+            if len(header) == 0: return None
+            length, = struct.unpack(FRAME_HEADER_FORMAT, header)
+            if not struct.calcsize(V2_REQUEST_FORMAT) <= length <= MAX_FRAME_SIZE:
+                raise OSError(f'invalid frame length {length}')
+            raw_data = self.recv_exact(length)
+            if len(raw_data) == 0: return None
+            request_id, command, filter_index, current_cycle, experiment_date, burst_frames, burst_method = struct.unpack_from(V2_REQUEST_FORMAT, raw_data)
+            payload = raw_data[struct.calcsize(V2_REQUEST_FORMAT):]
+        sequence = self.unpack_sequence(payload) if command == Command.SHOT_SEQUENCE else None
+        return request_id, command, filter_index, current_cycle, experiment_date.decode('utf8'), burst_frames, burst_method, sequence
+
+    def unpack_sequence(self, payload:bytes) -> list:
+        """ SHOT_SEQUENCE filter indices, empty list when the payload is too short """
+        if len(payload) < struct.calcsize(SEQUENCE_FORMAT): return []
+        count, *filter_indices = struct.unpack_from(SEQUENCE_FORMAT, payload)
+        return filter_indices[:count]
+
+    def pack_sequence_result(self) -> bytes:
+        """ SHOT_SEQUENCE result of this connection (count 0 on error) """
+        result = self.sequence_result or {'intensities' : [], 'cycle_time' : 0.0, 'transactions' : 0}
+        intensities = result['intensities'][:MAX_SEQUENCE]
+        return struct.pack(SEQUENCE_RESULT_FORMAT, len(intensities), *intensities, *[-1] * (MAX_SEQUENCE - len(intensities)),
+                           result['cycle_time'], result['transactions'])
+
+    def pack_metrics(self) -> tuple:
+        """ (stage count, METRIC_FORMAT of every stage) """
+        summary = list(metrics.summary().items())[:MAX_METRICS]
+        payload = b''.join(struct.pack(METRIC_FORMAT, stage.encode(), values['count'], values['p50_ms'], 
+                                       values['p95_ms'], values['p99_ms'], values['max_ms']) 
+                           for stage, values in summary)
+        return len(summary), payload
+
+    def send_metrics(self, request_id, reset:bool):
+        """ Reply stage timings (intensity : stage count) """
+        count, payload = self.pack_metrics()
+        if reset: metrics.reset()
+        if self.protocol == 1:
+            response = struct.pack(STATUS_FORMAT, error_code, count, error_message.encode()) + payload
+        else:
+            response = struct.pack(V2_RESPONSE_FORMAT, request_id, Command.METRICS, error_code, count, error_message.encode()) + payload
+            response = struct.pack(FRAME_HEADER_FORMAT, len(response)) + response
+        with self.send_lock:
+            self.request.sendall(response)
+
+    def send_response(self, request_id, command:int, intensity:int, intensities:list, busy:bool=False):
+        """ 
+        v1 : reply STATUS, STATUS_EX, PROTOCOL and SHOT_SEQUENCE only, v2 : reply every command with request id
+        busy : command refused while a sequence runs (error code Busy, not kept as the server error)
+        """
+        code, message = (ErrorCode.Busy, 'Shot sequence running') if busy else (error_code, error_message)
+        wells = list(intensities[:MAX_WELLS]) + [-1] * (MAX_WELLS - len(intensities))
+        if self.protocol == 1:
+            if command in [ Command.STATUS, Command.PROTOCOL ]:
+                response = struct.pack(STATUS_FORMAT, code, intensity, message.encode())
+            elif command == Command.STATUS_EX: # status with intensity of every well
+                response = struct.pack(STATUS_EX_FORMAT, code, intensity, message.encode(), 
+                                       len(intensities), *wells)
+            elif command == Command.SHOT_SEQUENCE:
+                response = struct.pack(STATUS_FORMAT, code, intensity, message.encode())
+                response += self.pack_sequence_result()
+            else: return
+        else:
+            response = struct.pack(V2_RESPONSE_FORMAT, request_id, command, code, intensity, message.encode())
+            if command == Command.STATUS_EX:
+                response += struct.pack(WELLS_FORMAT, len(intensities), *wells)
+            elif command == Command.SHOT_SEQUENCE:
+                response += self.pack_sequence_result()
+            response = struct.pack(FRAME_HEADER_FORMAT, len(response)) + response
+        with self.send_lock:
+            self.request.sendall(response)
+
+    def subscribe(self, state:bool):
+        """ Start/stop pushing SHOT_DONE events (protocol v2 only) """
+        if self.protocol == 1 or shot_worker is None:
+            server_logger.info('SHOT_DONE subscription needs protocol v2')
+            return
+        self.subscribed = state
+        if state and (self.pusher is None or not self.pusher.is_alive()):
+            self.pusher = threading.Thread(target=self.push_events, daemon=True)
+            self.pusher.start()
+        elif not state:
+            shot_worker.notifier.wake()
+        server_logger.info(f'SHOT_DONE subscription {state}')
+
+    def push_events(self):
+        """ Push SHOT_DONE events as soon as the shot worker publishes a result """
+        sequence = shot_worker.notifier.sequence
+        while self.subscribed:
+            sequence, result = shot_worker.notifier.wait(sequence)
+            if result is None or not self.subscribed: continue
+            intensities = result['intensities'][:MAX_WELLS]
+            wells = list(intensities) + [-1] * (MAX_WELLS - len(intensities))
+            event = struct.pack(V2_RESPONSE_FORMAT, 0, Command.SHOT_DONE, error_code, result['intensity'], error_message.encode())
+            event += struct.pack(SHOT_DONE_FORMAT, result['cycle'], result['filter_index'], result['shot_time'])
+            event += struct.pack(WELLS_FORMAT, len(intensities), *wells)
+            try:
+                with self.send_lock:
+                    self.request.sendall(struct.pack(FRAME_HEADER_FORMAT, len(event)) + event)
+            except OSError:
+                break
+
     
     def handle(self):
         global server_running
         global serial_task, shot_worker
         global error_code, error_message
+        self.protocol = 1
         try:
-            serial_task.set_device_state(DeviceState.READY)
+            with self.server.device_lock:
+                if serial_task and self.server.ready_pending:
+                    self.server.ready_pending = False
+                    serial_task.set_device_state(DeviceState.READY)
             while server_running:
-                intensity = -1
-                raw_data = self.request.recv(BUFFER_SIZE)
-                if len(raw_data) == 0: break # connection broken
-                command, filter_index, current_cycle, experiment_date, _ = struct.unpack('3B15s110s', raw_data)
-                experiment_date = experiment_date.decode('utf8')
+                intensity, intensities = -1, []
+                received = self.recv_command()
+                if received is None: break # connection broken
+                received_time = time.perf_counter()
+                request_id, command, filter_index, current_cycle, experiment_date, burst_frames, burst_method, sequence = received
+                if command == Command.PROTOCOL:
+                    # reply with the current protocol, then switch
+                    accepted = filter_index if filter_index in PROTOCOL_VERSIONS else self.protocol
+                    server_logger.info(f'protocol requested v{filter_index}, accepted v{accepted}')
+                    self.send_response(request_id, command, accepted, [])
+                    self.protocol = accepted
+                    continue
+                if command == Command.SUBSCRIBE:
+                    self.subscribe(bool(filter_index))
+                    self.send_response(request_id, command, int(self.subscribed), [])
+                    continue
+                if command == Command.METRICS:
+                    self.send_metrics(request_id, bool(filter_index))
+                    continue
+                if command == Command.SHOT_SEQUENCE:
+                    self.sequence_result = None
+                busy = False
                 if error_code == ErrorCode._: # check error occurred
-                    intensity = self.command_handler(command, filter_index, current_cycle,experiment_date)
-                if command == Command.STATUS: # only response status command
-                    response = struct.pack('=Bi100s', error_code, intensity, error_message.encode())
-                    self.request.send(response)
+                    with self.server.device_lock:
+                        # only read-only commands while the sequence of another connection runs
+                        busy = (self.server.sequence_owner not in (None, self) and 
+                                command not in [ Command.STATUS, Command.STATUS_EX ])
+                        if not busy:
+                            intensity, intensities = self.command_handler(command, filter_index, current_cycle,experiment_date,
+                                                                          burst_frames, burst_method, sequence)
+                self.send_response(request_id, command, intensity, intensities, busy)
+                if command in [ Command.STATUS, Command.STATUS_EX ]:
+                    metrics.record('status', time.perf_counter() - received_time)
             server_logger.info('Server command handling loop done.')
         except KeyboardInterrupt: 
             server_logger.info('Keyboard interrupt')
@@ -134,14 +378,20 @@ class CommandHandler(BaseRequestHandler):
         except BaseException as e:
             server_logger.error(f'Unknown exception {str(e)}')
         finally: 
-            if error_code != ErrorCode.SerialError:
-                if serial_task:serial_task.set_device_state(DeviceState.OFF)
-            raise SystemExit('Terminate Server...')
+            if self.subscribed:
+                self.subscribed = False
+                shot_worker.notifier.wake()
+            # terminate server when the last client is disconnected or exit command
+            if self.server.disconnected() or not server_running:
+                with self.server.device_lock:
+                    if error_code != ErrorCode.SerialError:
+                        if serial_task:serial_task.set_device_state(DeviceState.OFF)
+                self.server.terminate('Terminate Server...')
 
 
 
 if __name__ == '__main__':
-    server = TCPServer((HOST, PORT), CommandHandler)
+    server = RunnerServer((HOST, PORT), CommandHandler, max_connections=args.max_connections)
     try:
         server.serve_forever()
     except SystemExit as e:
@@ -151,4 +401,6 @@ if __name__ == '__main__':
     finally:
         if shot_worker is not None: shot_worker.close()
         if serial_task is not None: serial_task.close()
-        server.server_close()
\ No newline at end of file
+        server.server_close()
+        server_logger.debug(f"log stats {get_log_stats()}")
+        stop_loggers()
\ No newline at end of file
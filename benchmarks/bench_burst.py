@@ -0,0 +1,46 @@
+""" Benchmark : intensity noise & time of burst capture on the emulated camera
+
+usage : python -m benchmarks.bench_burst [-n 30]
+"""
+import time
+import argparse
+import numpy as np
+from src.intensity import MaskIndex
+from src.burst import BurstAccumulator
+from src.common import MASK_PATH, BurstMethod, BURST_FRAME_TIMEOUT
+from emulator.serial_task import SerialEmulator
+from emulator.camera import CameraEmulator
+
+def shot(camera, mask_index, burst, frames, method):
+    burst.reset()
+    count = camera.frame_count
+    while burst.frames < frames:
+        count, frame = camera.wait_frame(count, BURST_FRAME_TIMEOUT)
+        burst.add(frame, 1, keep=method != BurstMethod.MEAN)
+    return int((mask_index.pixel_mean(burst.reduce(method)) - camera.dark) * 256)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='count', type=int, default=30, help='number of shots')
+    parser.add_argument('--fps', type=float, default=200)
+    args = parser.parse_args()
+
+    serial_task = SerialEmulator()
+    serial_task.excitation_led = True   # steady LED on, no exposure ramp
+    camera = CameraEmulator(serial_task, fps=args.fps, bright=8 + 2000 / 256)
+    mask_index = MaskIndex(np.load(MASK_PATH))
+    burst = BurstAccumulator(mask_index)
+    camera.start()
+
+    for frames in (1, 4, 8, 16):
+        for method in BurstMethod:
+            if frames == 1 and method != BurstMethod.MEAN: continue
+            start = time.perf_counter()
+            values = [shot(camera, mask_index, burst, frames, method) for _ in range(args.count)]
+            spend = (time.perf_counter() - start) / args.count
+            print(f"K={frames:2d} {method.name:7s} : mean {np.mean(values):8.1f}, "
+                  f"std {np.std(values):6.2f}, {spend*1e3:7.1f} ms/shot")
+    camera.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+""" Benchmark : camera control per shot, interfaces bound & focus sequence on every call vs CameraControlSession
+
+usage : python -m benchmarks.bench_control [-n 20] [--delay 0.05]
+
+The session runs on FakeControlBackend (no COM). Its behaviour is checked before the timings : unchanged
+values are not written, a COM error rebinds the interfaces & resets the cache, every thread binds its own
+interfaces and a second error in a row is raised.
+"""
+import time
+import argparse
+import threading
+from src.camera_control import CameraControlSession, CAMERA_CONTROL, VIDEO_PROC_AMP, CameraControl_Focus, VideoProcAmp_Gain, Flags_Manual
+from src.common import FOCUS, EXPOSURE, GAIN, GAMMA, LOW_LIGHT_COMPENSATION, WHITEBALACE
+from emulator.camera_control import FakeControlBackend, FakeCOMError
+
+DEVICE = 'HelloPCR00000'
+SETTINGS = (FOCUS, EXPOSURE, GAIN, GAMMA, LOW_LIGHT_COMPENSATION, WHITEBALACE)
+
+def count_calls(backend:FakeControlBackend, name:str) -> int:
+    return sum(1 for call in backend.calls if call[0] == name)
+
+def check_session(delay:float):
+    """ Assert the session's skip, rebind & per-thread binding behaviour """
+    backend = FakeControlBackend([DEVICE])
+    session = CameraControlSession(backend, DEVICE, delay)
+
+    # unchanged values are skipped
+    session.setup(*SETTINGS)
+    sets = count_calls(backend, 'set')
+    assert backend.properties[(CAMERA_CONTROL, CameraControl_Focus)] == (FOCUS, Flags_Manual), 'focus not set'
+    session.setup(*SETTINGS)
+    session.set_focus(FOCUS)
+    assert count_calls(backend, 'set') == sets, 'unchanged values written again'
+    assert session.get_stats()['binds'] == 1, 'interfaces bound again'
+
+    # COM error : enumerate & bind again, retry once, cached values are dropped
+    backend.fail = 1
+    assert session.set(VIDEO_PROC_AMP, VideoProcAmp_Gain, GAIN + 1), 'set after rebind failed'
+    assert backend.properties[(VIDEO_PROC_AMP, VideoProcAmp_Gain)] == (GAIN + 1, Flags_Manual), 'gain not set after rebind'
+    stats = session.get_stats()
+    assert stats['rebinds'] == 1 and stats['binds'] == 2, f'no rebind {stats}'
+    sets = count_calls(backend, 'set')
+    session.set_gamma(GAMMA)
+    assert count_calls(backend, 'set') == sets + 1, 'cache kept after rebind'
+
+    # interfaces are bound per thread
+    thread = threading.Thread(target=session.get, args=(CAMERA_CONTROL, CameraControl_Focus))
+    thread.start()
+    thread.join()
+    assert session.get_stats()['binds'] == 3 and len(session.interfaces) == 2, 'thread shares interfaces'
+
+    # error after the rebind is raised
+    backend.fail = 2
+    try:
+        session.set(VIDEO_PROC_AMP, VideoProcAmp_Gain, GAIN + 2)
+        raise AssertionError('second error not raised')
+    except FakeCOMError:
+        pass
+    backend.fail = 0
+
+def bench(shots:int, delay:float) -> tuple:
+    """ (seconds per shot unbound & uncached, seconds per shot with one session, backend calls of both) """
+    backend = FakeControlBackend([DEVICE])
+    start = time.perf_counter()
+    for _ in range(shots):
+        CameraControlSession(backend, DEVICE, delay).set_focus(FOCUS) # as the module level dshow functions
+    legacy_time, legacy_calls = (time.perf_counter() - start) / shots, len(backend.calls)
+
+    backend = FakeControlBackend([DEVICE])
+    session = CameraControlSession(backend, DEVICE, delay)
+    start = time.perf_counter()
+    for _ in range(shots):
+        session.set_focus(FOCUS)
+    return legacy_time, (time.perf_counter() - start) / shots, legacy_calls, len(backend.calls)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='shots', type=int, default=20)
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds between focus steps (device : 0.5)')
+    args = parser.parse_args()
+
+    check_session(0)
+    print("session checks : skip unchanged, rebind on error, per thread binding ok")
+    legacy_time, session_time, legacy_calls, session_calls = bench(args.shots, args.delay)
+    print(f"focus per shot : every call {legacy_time*1e3:8.3f} ms ({legacy_calls} backend calls), "
+          f"session {session_time*1e3:8.3f} ms ({session_calls} backend calls)")
+
+if __name__ == '__main__':
+    main()
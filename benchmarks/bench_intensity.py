@@ -0,0 +1,85 @@
+""" Micro-benchmark : boolean mask indexing vs precomputed flat index intensity
+
+usage : python -m benchmarks.bench_intensity [-n 200] [--wells 16]
+
+The shot line compares intensity & well intensities gathered separately vs in one gather (wells split
+the mask pixels in `--wells` bands).
+"""
+import time
+import argparse
+import numpy as np
+from src.intensity import MaskIndex, LabelIndex
+from src.common import MASK_PATH, ROI_AREA, FRAME_WIDTH, FRAME_HEIGHT
+
+def legacy_intensity(frame, mask, pos_roi, channel):
+    image = frame.copy()
+    image = image[pos_roi[0]:pos_roi[0]+ROI_AREA['height'], pos_roi[1]:pos_roi[1]+ROI_AREA['width']]
+    image = image[:, :, channel]
+    return int(np.mean(image[mask == 255]) * 256)
+
+def index_intensity(frame, mask_index, channel):
+    image = frame.copy()
+    return int(mask_index.mean(image, channel) * 256)
+
+def separate_intensities(frame, mask_index, well_index, channel):
+    intensity = int(mask_index.mean(frame, channel) * 256)
+    return intensity, [int(value * 256) for value in well_index.means(frame, channel)]
+
+def gathered_intensities(frame, mask_index, well_index, channel):
+    sums = well_index.pixel_sums(well_index.gather(frame, channel))
+    intensity = int(float(sums.sum()) / mask_index.count * 256)
+    return intensity, [int(value * 256) for value in sums / well_index.counts]
+
+def timeit(func, frames, *args):
+    start = time.perf_counter()
+    results = [func(frame, *args) for frame in frames]
+    return (time.perf_counter() - start) / len(frames), results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='count', type=int, default=200, help='number of frames')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--wells', type=int, default=16)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    mask = np.load(MASK_PATH)
+    pos_roi = (700, 1000)
+    mask_index = MaskIndex(mask, origin=pos_roi)
+
+    frames = [rng.integers(0, 256, (FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8) for _ in range(8)]
+    frames = [frames[i % len(frames)] for i in range(args.count)]
+
+    for channel in (1, 2):
+        legacy_time, legacy = timeit(legacy_intensity, frames, mask, pos_roi, channel)
+        index_time, index = timeit(index_intensity, frames, mask_index, channel)
+        assert legacy == index, 'intensity mismatch'
+        print(f"channel {channel} : legacy {legacy_time*1e3:.3f} ms, "
+              f"flat-index {index_time*1e3:.3f} ms, speedup x{legacy_time/index_time:.2f}")
+
+    # intensity & well intensities of a shot, wells are the mask pixels
+    labels = np.zeros(mask.shape, np.int32)
+    rows, cols = np.nonzero(mask == 255)
+    labels[rows, cols] = 1 + np.arange(len(rows)) * args.wells // len(rows)
+    well_index = LabelIndex(labels, origin=pos_roi)
+    for channel in (1, 2):
+        separate_time, separate = timeit(separate_intensities, frames, mask_index, well_index, channel)
+        gathered_time, gathered = timeit(gathered_intensities, frames, mask_index, well_index, channel)
+        assert separate == gathered, 'intensity mismatch'
+        print(f"shot channel {channel} : separate {separate_time*1e3:.3f} ms, one gather {gathered_time*1e3:.3f} ms, "
+              f"speedup x{separate_time/gathered_time:.2f}")
+
+    # without the full frame copy (intensity math only)
+    frame = frames[0]
+    crop = frame[pos_roi[0]:pos_roi[0]+ROI_AREA['height'], pos_roi[1]:pos_roi[1]+ROI_AREA['width'], 1]
+    start = time.perf_counter()
+    for _ in range(args.count): np.mean(crop[mask == 255])
+    legacy_time = (time.perf_counter() - start) / args.count
+    start = time.perf_counter()
+    for _ in range(args.count): mask_index.mean(frame, 1)
+    index_time = (time.perf_counter() - start) / args.count
+    print(f"math only : legacy {legacy_time*1e3:.3f} ms, flat-index {index_time*1e3:.3f} ms, "
+          f"speedup x{legacy_time/index_time:.2f}")
+
+if __name__ == '__main__':
+    main()
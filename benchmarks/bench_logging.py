@@ -0,0 +1,108 @@
+""" Benchmark : DEBUG logging cost on hot threads, synchronous file handler vs log queue
+
+usage : python -m benchmarks.bench_logging [-n 5] [--port 48894] [--calls 20000]
+
+call   : debug() latency of a hot thread while 2 threads log continuously (handler lock contention)
+runner : SHOT latency and STATUS latency polled during the shots, runner spawned with the shot pipeline
+         on synthesized frames, logging through the queue (default) or --sync-log
+"""
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import numpy as np
+from src.common import Command
+from src.logger import DailyFileHandler, DroppingQueueHandler
+from benchmarks.client import RunnerClient, spawn_runner
+
+def percentiles(samples:list) -> str:
+    p50, p99 = np.percentile(np.array(samples) * 1e6, [50, 99])
+    return f"p50 {p50:8.1f} us, p99 {p99:8.1f} us"
+
+def bench_calls(queued:bool, calls:int) -> list:
+    """ debug() call latencies of the measured thread """
+    with tempfile.TemporaryDirectory() as path:
+        file_handler = DailyFileHandler(path)
+        file_handler.setFormatter(logging.Formatter("%(asctime)s\t%(name)s\t%(levelname)s\t%(message)s"))
+        handler, listener = file_handler, None
+        if queued:
+            handler = DroppingQueueHandler()
+            listener = logging.handlers.QueueListener(handler.queue, file_handler)
+            listener.start()
+        logger = logging.getLogger(f'bench-{queued}')
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        logger.addHandler(handler)
+
+        stop = threading.Event()
+        def flood():
+            count = 0
+            while not stop.is_set():
+                logger.debug(f"camera frame {count}")
+                count += 1
+                time.sleep(0.0001)
+        threads = [threading.Thread(target=flood, daemon=True) for _ in range(2)]
+        for thread in threads: thread.start()
+
+        latencies = []
+        for index in range(calls):
+            start = time.perf_counter()
+            logger.debug(f"shot spend time : {index}, intensity : {index * 3}")
+            latencies.append(time.perf_counter() - start)
+        stop.set()
+        for thread in threads: thread.join()
+        if listener is not None: listener.stop()
+        logger.removeHandler(handler)
+        file_handler.close()
+    return latencies
+
+def bench_runner(port:int, sync_log:bool, shots:int) -> tuple:
+    """ (SHOT latencies, STATUS latencies during the shots) """
+    options = ['--emulate-pipeline', '-s', '-f', 'npy'] + (['--sync-log'] if sync_log else [])
+    runner = spawn_runner(port, *options)
+    try:
+        client = RunnerClient(port, protocol=2)
+        client.request(Command.SUBSCRIBE, 1)
+        poller = RunnerClient(port)
+        status_latencies, stop = [], threading.Event()
+        def poll():
+            while not stop.is_set():
+                start = time.perf_counter()
+                poller.request(Command.STATUS)
+                status_latencies.append(time.perf_counter() - start)
+                time.sleep(0.001)
+        thread = threading.Thread(target=poll, daemon=True)
+        thread.start()
+
+        shot_latencies = []
+        for cycle in range(shots):
+            start = time.perf_counter()
+            client.send(Command.SHOT, 0, cycle)
+            while client.recv()[1] != Command.SHOT_DONE: pass
+            shot_latencies.append(time.perf_counter() - start)
+        stop.set()
+        thread.join()
+        poller.close()
+        client.send(Command.EXIT)
+        client.close()
+    finally:
+        runner.wait(10)
+    return shot_latencies, status_latencies
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--shots', type=int, default=5)
+    parser.add_argument('-p', '--port', type=int, default=48894)
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+
+    for queued in (False, True):
+        print(f"call   {'queue' if queued else 'sync ':5s} : {percentiles(bench_calls(queued, args.calls))}")
+    for index, sync_log in enumerate((True, False)):
+        shots, statuses = bench_runner(args.port + index, sync_log, args.shots)
+        print(f"runner {'sync ' if sync_log else 'queue'} : SHOT mean {np.mean(shots)*1e3:8.1f} ms, "
+              f"STATUS {percentiles(statuses)}")
+
+if __name__ == '__main__':
+    main()
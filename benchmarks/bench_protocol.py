@@ -0,0 +1,58 @@
+""" Benchmark : v1 lock-step vs v2 pipelined command throughput against the emulator
+
+usage : python -m benchmarks.bench_protocol [-n 20000] [-w 1 8 32] [--port 48888] [--spawn]
+"""
+import time
+import argparse
+from src.common import Command
+from benchmarks.client import RunnerClient, spawn_runner
+
+def lock_step(client:RunnerClient, count:int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        client.request(Command.STATUS)
+    return time.perf_counter() - start
+
+def pipelined(client:RunnerClient, count:int, window:int) -> float:
+    """ Keep `window` requests in flight, check replies come in request order """
+    start = time.perf_counter()
+    sent, received, first_id = 0, 0, client.request_id + 1
+    while received < count:
+        while sent < count and sent - received < window:
+            client.send(Command.STATUS)
+            sent += 1
+        request_id = client.recv()[0]
+        assert request_id == first_id + received, f'reply order {request_id} != {first_id + received}'
+        received += 1
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='count', type=int, default=20000)
+    parser.add_argument('-w', '--windows', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('-p', '--port', type=int, default=48888)
+    parser.add_argument('--spawn', action='store_true', help='start runner in emulator mode')
+    args = parser.parse_args()
+
+    runner = spawn_runner(args.port, '-c', '3') if args.spawn else None
+    try:
+        control = RunnerClient(args.port) # keep runner alive between clients
+
+        client = RunnerClient(args.port, protocol=1)
+        spend = lock_step(client, args.count)
+        print(f"v1 lock-step : {args.count/spend:9.1f} req/s, {spend/args.count*1e6:7.1f} us/req")
+        client.close()
+
+        client = RunnerClient(args.port, protocol=2)
+        for window in args.windows:
+            spend = pipelined(client, args.count, window)
+            print(f"v2 window {window:3d} : {args.count/spend:9.1f} req/s, {spend/args.count*1e6:7.1f} us/req")
+        client.close()
+
+        control.send(Command.EXIT)
+        control.close()
+    finally:
+        if runner is not None: runner.wait(10)
+
+if __name__ == '__main__':
+    main()
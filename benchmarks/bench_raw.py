@@ -0,0 +1,57 @@
+""" Benchmark : camera thread CPU time per frame, driver BGR conversion vs raw capture with ROI conversion
+
+usage : python -m benchmarks.bench_raw [-n 60] [--formats YUY2 BGGR MJPG] [--fps 60]
+
+Full size frames are replayed as raw frames. The BGR path converts whole frames (as the driver does)
+then copies the ROI, the raw path converts only the ROI. Published ROI images of both paths are compared.
+"""
+import os
+import argparse
+import tempfile
+import numpy as np
+from src.camera import CameraBufferCleaner
+from src.camera_backend import ReplayBackend
+from src.common import ROI_AREA, FRAME_WIDTH, FRAME_HEIGHT, RAW_FORMATS
+
+def make_frames(path:str, count:int=4, seed:int=0):
+    """ Smooth full frames with noise, saved as Record images """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:FRAME_HEIGHT, 0:FRAME_WIDTH]
+    for index in range(count):
+        base = np.stack([x / FRAME_WIDTH * 150, y / FRAME_HEIGHT * 150, (x + y) / (FRAME_WIDTH + FRAME_HEIGHT) * 150], -1)
+        frame = np.clip(base + 40 + rng.normal(0, 3, base.shape), 0, 255).astype(np.uint8)
+        np.save(os.path.join(path, f'FAM_{index}_000000.npy'), frame)
+
+def run(source:str, format:str, raw:bool, frames:int, fps:float):
+    camera = CameraBufferCleaner(backend=ReplayBackend(source, fps, raw_format=format), raw_capture=raw)
+    camera.set_roi((700, 1000), (ROI_AREA['height'], ROI_AREA['width']))
+    camera.set_active(True)
+    camera.start()
+    count, frame = camera.wait_frame(0, 10)
+    start_stats = camera.get_stats()
+    while count < frames + 1:
+        count, frame = camera.wait_frame(count, 10)
+    image = camera.copy_frame()
+    stats = camera.get_stats()
+    camera.close()
+    cpu_time = (stats['cpu_time'] - start_stats['cpu_time']) / (stats['frames_read'] - start_stats['frames_read'])
+    return cpu_time, image
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', dest='frames', type=int, default=60, help='frames per run')
+    parser.add_argument('--formats', nargs='+', choices=RAW_FORMATS, default=['YUY2', 'BGGR', 'MJPG'])
+    parser.add_argument('--fps', type=float, default=60)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as source:
+        make_frames(source)
+        for format in args.formats:
+            bgr_time, bgr_image = run(source, format, False, args.frames, args.fps)
+            raw_time, raw_image = run(source, format, True, args.frames, args.fps)
+            same = 'same' if np.array_equal(bgr_image, raw_image) else 'DIFFERENT'
+            print(f"{format:5s} : BGR {bgr_time*1e3:7.3f} ms/frame, raw {raw_time*1e3:7.3f} ms/frame, "
+                  f"speedup x{bgr_time/raw_time:.2f}, ROI images {same}")
+
+if __name__ == '__main__':
+    main()
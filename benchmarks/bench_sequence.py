@@ -0,0 +1,50 @@
+""" Benchmark : time per cycle & serial transactions, one shot per dye vs SHOT_SEQUENCE of every dye
+
+usage : python -m benchmarks.bench_sequence [-n 3] [--port 48892] [--no-settle]
+
+The runner is spawned with the shot pipeline on synthesized frames (--emulate-pipeline). A one filter
+SHOT_SEQUENCE runs the same focus, LED on, exposure & LED off steps as SHOT, so the per dye case sends
+one of them per dye to get the serial transaction count.
+"""
+import time
+import argparse
+import numpy as np
+from src.common import Command, FLUORESCENCE
+from benchmarks.client import RunnerClient, spawn_runner
+
+def run_cycle(client:RunnerClient, cycle:int, sequences:list) -> tuple:
+    """ Return (intensities, cycle time, serial transactions) """
+    intensities, transactions = [], 0
+    start = time.perf_counter()
+    for sequence in sequences:
+        response = client.request(Command.SHOT_SEQUENCE, 0, cycle, sequence=sequence)
+        if response[2] != 0: raise RuntimeError(f'shot sequence error {response[4]}')
+        count, *values, _, serial_transactions = response[5]
+        intensities += values[:count]
+        transactions += serial_transactions
+    return intensities, time.perf_counter() - start, transactions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--cycles', type=int, default=3)
+    parser.add_argument('-p', '--port', type=int, default=48892)
+    parser.add_argument('--no-settle', dest='settle', action='store_false', help='fixed exposure wait')
+    args = parser.parse_args()
+
+    dyes = list(range(len(FLUORESCENCE)))
+    cases = {'per dye' : [[dye] for dye in dyes], 'sequence' : [dyes]}
+    runner = spawn_runner(args.port, '--emulate-pipeline', *(['-s'] if args.settle else []), '-f', 'npy')
+    try:
+        client = RunnerClient(args.port, protocol=2)
+        for name, sequences in cases.items():
+            results = [run_cycle(client, cycle, sequences) for cycle in range(args.cycles)]
+            intensities = results[-1][0]
+            print(f"{name:8s} : {np.mean([result[1] for result in results]):6.3f} s/cycle, "
+                  f"serial transactions {results[-1][2]}, intensities {intensities}")
+        client.send(Command.EXIT)
+        client.close()
+    finally:
+        runner.wait(10)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+""" Minimal runner protocol client for benchmarks """
+import os
+import sys
+import time
+import socket
+import struct
+import shutil
+import tempfile
+import subprocess
+from src.common import Command, PACKET_FORMAT, STATUS_FORMAT, STATUS_EX_FORMAT, WELLS_FORMAT
+from src.common import FRAME_HEADER_FORMAT, V2_REQUEST_FORMAT, V2_RESPONSE_FORMAT, SHOT_DONE_FORMAT
+from src.common import MAX_SEQUENCE, SEQUENCE_FORMAT, SEQUENCE_RESULT_FORMAT, METRIC_FORMAT
+
+# experiment date is a fixed 15 characters field (YYYYMMDD_HHMMSS) used as a folder name
+EXPERIMENT_DATE = '20000101_000000'
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNNER_PATH = os.path.join(REPO_PATH, 'HelloPCR-Runner.py')
+
+def spawn_runner(port:int, *options:str) -> subprocess.Popen:
+    """ Start the runner in emulator mode in a temporary directory (with the repository mask file) """
+    cwd = tempfile.mkdtemp()
+    if os.path.exists(os.path.join(REPO_PATH, 'mask.npy')):
+        shutil.copy(os.path.join(REPO_PATH, 'mask.npy'), cwd)
+    return subprocess.Popen([sys.executable, RUNNER_PATH, '-e', '-p', str(port), *options, '00000'], cwd=cwd)
+
+def sequence_payload(sequence:list) -> bytes:
+    """ SHOT_SEQUENCE filter indices """
+    if not sequence: return b''
+    return struct.pack(SEQUENCE_FORMAT, len(sequence), *sequence, *[0] * (MAX_SEQUENCE - len(sequence)))
+
+def packet(command:int, filter_index:int=0, cycle:int=0, experiment_date:str=EXPERIMENT_DATE, sequence:list=None) -> bytes:
+    return struct.pack(PACKET_FORMAT, command, filter_index, cycle, experiment_date.encode(), 0, 0, sequence_payload(sequence))
+
+def recv_exact(sock:socket.socket, size:int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk: raise ConnectionError('connection closed')
+        data += chunk
+    return data
+
+def connect(port:int, timeout:float=10) -> socket.socket:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            sock = socket.create_connection(('127.0.0.1', port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return sock
+        except OSError:
+            if time.perf_counter() > deadline: raise
+            time.sleep(0.1)
+
+class RunnerClient:
+    """ v1 : lock-step fixed packets, v2 : length framed requests with request id """
+    def __init__(self, port:int, protocol:int=1):
+        self.sock = connect(port)
+        self.protocol = 1
+        self.request_id = 0
+        if protocol != 1:
+            self.sock.sendall(packet(Command.PROTOCOL, protocol))
+            _, accepted, _ = struct.unpack(STATUS_FORMAT, recv_exact(self.sock, struct.calcsize(STATUS_FORMAT)))
+            if accepted != protocol: raise ConnectionError(f'protocol v{protocol} not accepted')
+            self.protocol = protocol
+
+    def send(self, command:int, filter_index:int=0, cycle:int=0, experiment_date:str=EXPERIMENT_DATE, 
+             sequence:list=None) -> int:
+        """ Send a command (SHOT_SEQUENCE : `sequence` filter indices), return request id (v2) """
+        if self.protocol == 1:
+            self.sock.sendall(packet(command, filter_index, cycle, experiment_date, sequence))
+            return None
+        self.request_id += 1
+        body = struct.pack(V2_REQUEST_FORMAT, self.request_id, command, filter_index, cycle, experiment_date.encode(), 0, 0)
+        body += sequence_payload(sequence)
+        self.sock.sendall(struct.pack(FRAME_HEADER_FORMAT, len(body)) + body)
+        return self.request_id
+
+    def recv(self, command:int=Command.STATUS) -> tuple:
+        """ 
+        v1 : (error code, intensity, message[, sequence result]), 
+        v2 : (request id, command, error code, intensity, message[, (cycle, filter index, shot time)][, wells | sequence result])
+        sequence result : (count, intensity per filter index, cycle time, serial transactions)
+        """
+        if self.protocol == 1:
+            if command == Command.SHOT_SEQUENCE:
+                fmt = STATUS_FORMAT + SEQUENCE_RESULT_FORMAT[1:]
+                response = struct.unpack(fmt, recv_exact(self.sock, struct.calcsize(fmt)))
+                return response[:3] + (response[3:],)
+            fmt = STATUS_EX_FORMAT if command == Command.STATUS_EX else STATUS_FORMAT
+            return struct.unpack(fmt, recv_exact(self.sock, struct.calcsize(fmt)))
+        length, = struct.unpack(FRAME_HEADER_FORMAT, recv_exact(self.sock, struct.calcsize(FRAME_HEADER_FORMAT)))
+        body = recv_exact(self.sock, length)
+        response = struct.unpack_from(V2_RESPONSE_FORMAT, body)
+        offset = struct.calcsize(V2_RESPONSE_FORMAT)
+        if response[1] == Command.SHOT_DONE:
+            response += (struct.unpack_from(SHOT_DONE_FORMAT, body, offset),)
+            offset += struct.calcsize(SHOT_DONE_FORMAT)
+        if response[1] == Command.SHOT_SEQUENCE:
+            response += (struct.unpack_from(SEQUENCE_RESULT_FORMAT, body, offset),)
+        elif length > offset:
+            response += (struct.unpack_from(WELLS_FORMAT, body, offset),)
+        return response
+
+    def metrics(self, reset:bool=False) -> dict:
+        """ METRICS request, {stage : {count, p50_ms, p95_ms, p99_ms, max_ms}} """
+        self.send(Command.METRICS, int(reset))
+        size = struct.calcsize(METRIC_FORMAT)
+        if self.protocol == 1:
+            _, count, _ = struct.unpack(STATUS_FORMAT, recv_exact(self.sock, struct.calcsize(STATUS_FORMAT)))
+            payload = recv_exact(self.sock, count * size)
+        else:
+            length, = struct.unpack(FRAME_HEADER_FORMAT, recv_exact(self.sock, struct.calcsize(FRAME_HEADER_FORMAT)))
+            body = recv_exact(self.sock, length)
+            count = struct.unpack_from(V2_RESPONSE_FORMAT, body)[3]
+            payload = body[struct.calcsize(V2_RESPONSE_FORMAT):]
+        summary = {}
+        for index in range(count):
+            stage, *values = struct.unpack_from(METRIC_FORMAT, payload, index * size)
+            summary[stage.rstrip(b'\x00').decode()] = dict(zip(('count', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'), values))
+        return summary
+
+    def request(self, command:int, *args, **kwargs) -> tuple:
+        self.send(command, *args, **kwargs)
+        return self.recv(command)
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,53 @@
+""" Load test : a full PCR run (cycles x dyes SHOT requests) against the time scaled emulator
+
+usage : python -m benchmarks.emulated_run [--cycles 40] [--time-scale 0.001] [--port 48888] [--spawn]
+
+Every SHOT waits its SHOT_DONE event (protocol v2 subscription).
+"""
+import time
+import argparse
+from src.common import Command, FLUORESCENCE
+from benchmarks.client import RunnerClient, spawn_runner
+
+def run(client:RunnerClient, cycles:int) -> list:
+    """ Return SHOT request to SHOT_DONE latencies """
+    latencies = []
+    for cycle in range(cycles):
+        for filter_index in range(len(FLUORESCENCE)):
+            start = time.perf_counter()
+            client.send(Command.SHOT, filter_index, cycle)
+            while True:
+                response = client.recv()
+                if response[1] == Command.SHOT_DONE: break
+            event_cycle, event_filter, _ = response[5]
+            assert (event_cycle, event_filter) == (cycle, filter_index), f'unexpected shot {response[5]}'
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--cycles', type=int, default=40)
+    parser.add_argument('-t', '--time-scale', type=float, default=0.001)
+    parser.add_argument('-p', '--port', type=int, default=48888)
+    parser.add_argument('--spawn', action='store_true', help='start runner in emulator mode')
+    args = parser.parse_args()
+
+    runner = spawn_runner(args.port, '--time-scale', str(args.time_scale)) if args.spawn else None
+    try:
+        client = RunnerClient(args.port, protocol=2)
+        client.request(Command.SUBSCRIBE, 1)
+
+        start = time.perf_counter()
+        latencies = run(client, args.cycles)
+        spend = time.perf_counter() - start
+        print(f"{args.cycles} cycles x {len(FLUORESCENCE)} dyes, {len(latencies)} shots in {spend:.2f}s, "
+              f"time scale {args.time_scale}")
+        print(f"shot latency ms : mean {sum(latencies)/len(latencies)*1e3:.2f}, max {max(latencies)*1e3:.2f}")
+
+        client.send(Command.EXIT)
+        client.close()
+    finally:
+        if runner is not None: runner.wait(10)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+""" Load generator : STATUS throughput & latency of the runner with concurrent clients
+
+usage : python -m benchmarks.load_generator [-c 4] [-d 5] [--port 48888] [--spawn]
+
+--spawn starts the runner in emulator mode on `--port` in a temporary directory.
+"""
+import time
+import socket
+import struct
+import argparse
+import threading
+import numpy as np
+from src.common import Command, STATUS_FORMAT
+from benchmarks.client import spawn_runner, packet, recv_exact, connect
+
+def status_client(sock:socket.socket, duration:float, latencies:list):
+    request, size = packet(Command.STATUS), struct.calcsize(STATUS_FORMAT)
+    end_time = time.perf_counter() + duration
+    while time.perf_counter() < end_time:
+        start = time.perf_counter()
+        sock.sendall(request)
+        recv_exact(sock, size)
+        latencies.append(time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--clients', type=int, default=4)
+    parser.add_argument('-d', '--duration', type=float, default=5)
+    parser.add_argument('-p', '--port', type=int, default=48888)
+    parser.add_argument('--spawn', action='store_true', help='start runner in emulator mode')
+    args = parser.parse_args()
+
+    runner = spawn_runner(args.port, '-c', str(args.clients + 1)) if args.spawn else None
+    try:
+        # control client stays connected, so the runner is not terminated between runs
+        control = connect(args.port)
+        sockets = [connect(args.port) for _ in range(args.clients)]
+        results = [[] for _ in sockets]
+        threads = [threading.Thread(target=status_client, args=(sock, args.duration, latencies))
+                   for sock, latencies in zip(sockets, results)]
+        start = time.perf_counter()
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        spend = time.perf_counter() - start
+
+        latencies = np.array([latency for result in results for latency in result]) * 1e3
+        print(f"clients {args.clients}, requests {len(latencies)}, throughput {len(latencies)/spend:.1f} req/s")
+        print(f"latency ms : p50 {np.percentile(latencies, 50):.3f}, p95 {np.percentile(latencies, 95):.3f}, "
+              f"p99 {np.percentile(latencies, 99):.3f}, max {latencies.max():.3f}")
+
+        for sock in sockets: sock.close()
+        control.sendall(packet(Command.EXIT))
+        control.close()
+    finally:
+        if runner is not None: runner.wait(10)
+
+if __name__ == '__main__':
+    main()
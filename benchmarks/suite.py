@@ -0,0 +1,215 @@
+""" Benchmark suite : hot paths of the runner with JSON results and baseline comparison
+
+usage : python -m benchmarks.suite [-o results.json] [--baseline benchmarks/baseline.json] [--save-baseline]
+                                   [--cases status shot intensity save serial] [--tolerance 0.5] [--repeat 5] [--noise 3]
+
+status    : STATUS round trip through CommandHandler (emulator runner)
+shot      : SHOT request to SHOT_DONE through the real ShotWorker on synthesized frames (settle mode)
+intensity : mask intensity per frame size
+save      : image archive encode time per format
+serial    : SerialTask transaction cost against the pty fake firmware (posix only)
+
+Every case runs `repeat` times, the median of every metric is kept with its run to run spread (median
+absolute deviation scaled to a standard deviation). Metrics ending with `_per_s` are higher-better, the others (times) lower-better.
+A metric worse than the baseline by more than `tolerance` and by more than `noise` times the larger
+relative spread (spread / median) of the baseline and the results is reported as a regression and the
+exit code is 1.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+from src.common import Command, MASK_PATH, ROI_AREA, FRAME_WIDTH, FRAME_HEIGHT, ARCHIVE_FORMATS
+from benchmarks.client import RunnerClient, spawn_runner
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# save case writes to memory when possible, disk write back is not the encode time
+SAVE_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+def percentiles(name:str, samples:list) -> dict:
+    samples = np.array(samples) * 1e3
+    return {f'{name}.p50_ms' : float(np.percentile(samples, 50)),
+            f'{name}.p99_ms' : float(np.percentile(samples, 99))}
+
+def bench_status(port:int, count:int=5000) -> dict:
+    runner = spawn_runner(port, '--time-scale', '0.001')
+    try:
+        client = RunnerClient(port)
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(count):
+            request_time = time.perf_counter()
+            client.request(Command.STATUS)
+            latencies.append(time.perf_counter() - request_time)
+        spend = time.perf_counter() - start
+        client.send(Command.EXIT)
+        client.close()
+    finally:
+        runner.wait(10)
+    return {**percentiles('status', latencies), 'status.requests_per_s' : count / spend}
+
+def bench_shot(port:int, count:int=5) -> dict:
+    runner = spawn_runner(port, '--emulate-pipeline', '-s', '-f', 'stack')
+    try:
+        client = RunnerClient(port, protocol=2)
+        client.request(Command.SUBSCRIBE, 1)
+        latencies = []
+        for cycle in range(count):
+            start = time.perf_counter()
+            client.send(Command.SHOT, 0, cycle)
+            while client.recv()[1] != Command.SHOT_DONE: pass
+            latencies.append(time.perf_counter() - start)
+        client.send(Command.EXIT)
+        client.close()
+    finally:
+        runner.wait(10)
+    return percentiles('shot', latencies)
+
+def bench_intensity(count:int=200) -> dict:
+    from src.intensity import MaskIndex, LabelIndex
+    mask = np.load(MASK_PATH)
+    pos_roi = (700, 1000)
+    mask_index = MaskIndex(mask, origin=pos_roi)
+    well_index = LabelIndex((mask == 255).astype(np.uint8), origin=pos_roi)
+    rng = np.random.default_rng(0)
+    frames = {'roi' : rng.integers(0, 256, (ROI_AREA['height'], ROI_AREA['width'], 3), dtype=np.uint8),
+              'full' : rng.integers(0, 256, (FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)}
+
+    results = {}
+    for name, frame in frames.items():
+        for label, function in (('mean', mask_index.mean), ('wells', well_index.means)):
+            function(frame, 1) # flat index cache
+            start = time.perf_counter()
+            for _ in range(count): function(frame, 1)
+            results[f'intensity.{label}_{name}_ms'] = (time.perf_counter() - start) / count * 1e3
+    return results
+
+def bench_save(count:int=10) -> dict:
+    from src.archive import ImageArchiver
+    from src.stack import ImageStack
+    rng = np.random.default_rng(0)
+    # smooth image with noise, closer to the tube images than uniform noise
+    shape = (ROI_AREA['height'], ROI_AREA['width'], 3)
+    img = 60 + 40 * np.sin(np.arange(shape[0]) / 40)[:, None, None] + rng.normal(0, 2, shape)
+    img = np.clip(img, 0, 255).astype(np.uint8)
+
+    results = {}
+    with tempfile.TemporaryDirectory(dir=SAVE_DIR) as path:
+        for format in ARCHIVE_FORMATS:
+            archiver = ImageArchiver(format=format)
+            stack = ImageStack(os.path.join(path, 'stack')) if format == 'stack' else None
+            start = time.perf_counter()
+            for index in range(count):
+                if stack is not None: stack.append(img, cycle=index)
+                else: archiver.write(os.path.join(path, f'{index}.{format}'), img)
+            results[f'save.{format}_ms'] = (time.perf_counter() - start) / count * 1e3
+            if stack is not None: stack.close()
+    return results
+
+def bench_serial(count:int=2000) -> dict:
+    from emulator.trinket import FakeTrinket
+    from src.serial_task import SerialTask
+    trinket = FakeTrinket()
+    trinket.start()
+    serial_task = SerialTask(trinket.serial_number, port=trinket.port)
+    try:
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            serial_task.submit('i', read=True).result()
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        futures = [serial_task.submit('i', read=True) for _ in range(count)]
+        for future in futures: future.result()
+        spend = time.perf_counter() - start
+    finally:
+        serial_task.close()
+        trinket.close()
+    return {**percentiles('serial', latencies), 'serial.pipelined_per_s' : count / spend}
+
+CASES = {
+    'status'    : lambda args: bench_status(args.port),
+    'shot'      : lambda args: bench_shot(args.port + 1),
+    'intensity' : lambda args: bench_intensity(),
+    'save'      : lambda args: bench_save(),
+    'serial'    : lambda args: bench_serial(),
+}
+
+def summarize(runs:list) -> tuple:
+    """ ({metric : median}, {metric : spread}) over repeated runs, spread : median absolute deviation as a std """
+    results, spread = {}, {}
+    for metric in runs[0]:
+        values = np.array([run[metric] for run in runs])
+        results[metric] = float(np.median(values))
+        spread[metric] = float(1.4826 * np.median(np.abs(values - results[metric]))) # std of normal noise
+    return results, spread
+
+def compare(results:dict, spread:dict, baseline:dict, baseline_spread:dict, tolerance:float, noise:float) -> list:
+    """ Return [(metric, baseline, result, ratio)] of regressions """
+    regressions = []
+    for metric, base in baseline.items():
+        if metric not in results or not base: continue
+        ratio = results[metric] / base
+        slowdown = 1 / ratio if metric.endswith('_per_s') else ratio
+        # relative run to run noise of this metric, a uniform slowdown does not widen it
+        relative_spread = max(spread.get(metric, 0.0) / results[metric], baseline_spread.get(metric, 0.0) / base)
+        if slowdown - 1 > max(tolerance, noise * relative_spread):
+            regressions.append((metric, base, results[metric], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', type=str, default=None, help='results json path')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--baseline', type=str, default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed ratio worse than baseline')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='runs per case, the median is compared')
+    parser.add_argument('--noise', type=float, default=3, help='run to run spreads a regression must exceed')
+    parser.add_argument('-p', '--port', type=int, default=48890)
+    args = parser.parse_args()
+
+    results, spread = {}, {}
+    for case in args.cases:
+        if case == 'serial' and os.name != 'posix':
+            print("skip serial, pty fake firmware needs posix")
+            continue
+        case_results, case_spread = summarize([CASES[case](args) for _ in range(args.repeat)])
+        results.update(case_results)
+        spread.update(case_spread)
+        print(f"{case} done")
+
+    report = {'platform' : platform.platform(), 'python' : platform.python_version(), 'repeat' : args.repeat,
+              'time' : time.strftime('%Y-%m-%dT%H:%M:%S'), 'results' : results, 'spread' : spread}
+    for metric, value in sorted(results.items()):
+        print(f"{metric:32s} {value:12.3f} +- {spread[metric]:.3f}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"baseline saved '{args.baseline}'")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline '{args.baseline}'")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, spread, baseline['results'], baseline.get('spread', {}), args.tolerance, args.noise)
+    for metric, base, result, ratio in regressions:
+        print(f"REGRESSION {metric} : baseline {base:.3f}, now {result:.3f} (x{ratio:.2f})")
+    if regressions:
+        sys.exit(1)
+    print(f"no regression against '{args.baseline}' (tolerance {args.tolerance}, noise {args.noise})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import time
+import threading
+import numpy as np
+from src.common import ROI_AREA, CAMERA_IDLE_INTERVAL
+
+class CameraEmulator(threading.Thread):
+    """ Camera emulator generating ROI sized frames with an exposure ramp after excitation LED on """
+    def __init__(self, serial_task, fps:float=15, tau:float=0.25, dark:float=8,
+                 bright:float=120, noise:float=1.0, flicker:float=0.1, seed:int=0, time_scale:float=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.error = None
+        self.stop_flag = False
+        self.last_frame = None
+        self.frame_count = 0
+        self.frame_cond = threading.Condition()
+
+        self.serial_task = serial_task
+        self.fps = fps / time_scale
+        self.tau = tau * time_scale # exposure ramp time constant (seconds)
+        self.dark = dark        # level while excitation LED off
+        self.bright = bright    # settled level while excitation LED on
+        self.noise = noise      # gaussian pixel noise sigma
+        self.flicker = flicker  # gaussian frame level noise sigma
+        self.rng = np.random.default_rng(seed)
+
+        self.active = threading.Event()
+        self.active.set()
+        self.stats = {'frames_read' : 0, 'frames_drained' : 0, 'cpu_time' : 0.0, 'run_time' : 0.0}
+
+    def level(self, now:float) -> float:
+        """ Exposure ramp : exponential approach to the LED on/off level """
+        on, changed = self.serial_task.excitation_led, self.serial_task.led_time
+        target, origin = (self.bright, self.dark) if on else (self.dark, self.bright)
+        if changed is None: return target
+        return target + (origin - target) * np.exp(-(now - changed) / self.tau)
+
+    def render(self, now:float) -> np.ndarray:
+        shape = (ROI_AREA['height'], ROI_AREA['width'], 3)
+        level = self.level(now) + self.rng.normal(0, self.flicker)
+        frame = level + self.rng.normal(0, self.noise, shape)
+        return np.clip(np.rint(frame), 0, 255).astype(np.uint8)
+
+    def set_active(self, active:bool):
+        if active: self.active.set()
+        else: self.active.clear()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['cpu_usage'] = stats['cpu_time'] / stats['run_time'] if stats['run_time'] else 0.0
+        return stats
+
+    def set_focus(self, focus):
+        return
+
+    def get_frame(self):
+        if self.error is not None:
+            raise self.error
+        return self.last_frame
+
+    def copy_frame(self, out=None):
+        with self.frame_cond:
+            if self.error is not None:
+                raise self.error
+            if out is None or out.shape != self.last_frame.shape:
+                return self.last_frame.copy()
+            np.copyto(out, self.last_frame)
+            return out
+
+    def wait_frame(self, count, timeout=None):
+        """ Wait a frame newer than frame number `count`, return (frame_count, frame), frame is None on timeout """
+        with self.frame_cond:
+            if not self.frame_cond.wait_for(lambda: self.frame_count > count or self.error is not None, timeout):
+                return count, None
+            if self.error is not None:
+                raise self.error
+            return self.frame_count, self.last_frame
+
+    def run(self):
+        interval = 1 / self.fps
+        start_time, start_cpu = time.perf_counter(), time.thread_time()
+        while not self.stop_flag:
+            self.stats['cpu_time'] = time.thread_time() - start_cpu
+            self.stats['run_time'] = time.perf_counter() - start_time
+            if not self.active.is_set():
+                # idle : frames are dropped without rendering
+                self.stats['frames_drained'] += 1
+                self.active.wait(CAMERA_IDLE_INTERVAL)
+                continue
+
+            frame = self.render(time.perf_counter())
+            with self.frame_cond:
+                self.last_frame = frame
+                self.frame_count += 1
+                self.frame_cond.notify_all()
+            self.stats['frames_read'] += 1
+            time.sleep(interval)
+
+    def close(self):
+        self.stop_flag = True
+        self.active.set()
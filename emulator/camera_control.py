@@ -0,0 +1,36 @@
+class FakeCOMError(Exception):
+    pass
+
+class FakeControlBackend:
+    """ In-memory camera control backend for CameraControlSession, `fail` : next calls raising FakeCOMError """
+    error = FakeCOMError
+
+    def __init__(self, devices=('HelloPCR00000',)):
+        self.devices = list(devices)
+        self.properties = {} # {(interface, property) : (value, flag)}
+        self.calls = []
+        self.fail = 0
+
+    def check_fail(self):
+        if self.fail:
+            self.fail -= 1
+            raise FakeCOMError("device unplugged")
+
+    def enumerate(self):
+        self.calls.append(('enumerate',))
+        return {name : f'moniker-{name}' for name in self.devices}
+
+    def bind(self, moniker):
+        self.calls.append(('bind', moniker))
+        self.check_fail()
+        return {'camera_control' : 'camera_control', 'video_proc_amp' : 'video_proc_amp'}
+
+    def set(self, interface, property_, value, flag):
+        self.calls.append(('set', interface, property_, value, flag))
+        self.check_fail()
+        self.properties[(interface, property_)] = (value, flag)
+
+    def get(self, interface, property_):
+        self.calls.append(('get', interface, property_))
+        self.check_fail()
+        return self.properties.get((interface, property_), (0, 0))
@@ -0,0 +1,126 @@
+import os
+import numpy as np
+from src.camera_backend import CameraBackend, FramePacer
+from src.common import FRAME_WIDTH, FRAME_HEIGHT, ROI_AREA, MASK_PATH, WELL_MASK_PATH, FLUORESCENCE, FLUOR_CHANNEL
+
+# amplification curve per fluorophore (pixel levels above dark) : baseline + amplitude / (1 + exp(-(cycle - ct) / slope))
+AMPLIFICATION = {
+    'FAM' : {'baseline' : 12, 'amplitude' : 90, 'ct' : 22, 'slope' : 1.6},
+    'HEX' : {'baseline' : 10, 'amplitude' : 70, 'ct' : 25, 'slope' : 1.8},
+    'ROX' : {'baseline' : 14, 'amplitude' : 60, 'ct' : 27, 'slope' : 1.7},
+    'CY5' : {'baseline' : 8,  'amplitude' : 50, 'ct' : 30, 'slope' : 2.0},
+}
+
+def amplification(cycle:float, baseline:float, amplitude:float, ct:float, slope:float) -> float:
+    return baseline + amplitude / (1 + np.exp(-(cycle - ct) / slope))
+
+class FrameSynthesizer(CameraBackend):
+    """
+    Camera backend rendering full frames of the PCR tube ROI at the serial reference position
+
+    Wells of the mask glow with the amplification curve of the current sample (set_sample) while
+    the excitation LED is on, with an exponential LED on/off transition. The pixel pattern (fixed pattern
+    noise, well Ct jitter) is seeded by (seed, fluorescence, cycle), so settled frames are deterministic,
+    `temporal_noise` adds per frame noise from the seeded generator. With `batch`, the other channels
+    show the dye a batch shot reads from them, as rendered alone.
+    """
+    name = 'synthesizer'
+
+    def __init__(self, serial_task, mask:np.ndarray=None, wells:np.ndarray=None, fps:float=15, seed:int=0,
+                 dark:float=8, autofluorescence:float=4, pattern_noise:float=1.0, temporal_noise:float=0.0,
+                 ct_spread:float=0.5, tau:float=0.25, curves:dict=AMPLIFICATION, batch:bool=False):
+        self.serial_task = serial_task
+        self.batch = batch                      # render the partner dyes in the other channels (batch shot)
+        self.seed = seed
+        self.dark = dark                        # level while excitation LED off
+        self.autofluorescence = autofluorescence # level of every channel while excitation LED on
+        self.pattern_noise = pattern_noise      # gaussian fixed pattern noise sigma
+        self.temporal_noise = temporal_noise    # gaussian per frame noise sigma
+        self.ct_spread = ct_spread              # gaussian Ct jitter of wells
+        self.tau = tau                          # LED transition time constant (seconds)
+        self.curves = curves
+        self.pacer = FramePacer(fps)
+        self.rng = np.random.default_rng(seed)
+        self.stats = {'frames' : 0}
+
+        if mask is None:
+            mask = np.load(MASK_PATH)
+        if wells is None:
+            wells = np.load(WELL_MASK_PATH) if os.path.exists(WELL_MASK_PATH) else (mask == 255).astype(np.uint8)
+        self.wells = np.where(mask == 255, wells, 0)
+        self.shape = (ROI_AREA['height'], ROI_AREA['width'], 3)
+
+        x, y = serial_task.get_reference_position()
+        self.position = (y - ROI_AREA['dy'], x - ROI_AREA['dx'])
+        self.canvases = set() # ids of frame buffers with the dark background
+
+        self.off_image = np.full(self.shape, dark, np.float32)
+        self.set_sample(FLUORESCENCE[0], 0)
+
+    def set_sample(self, fluorescence:str, cycle:int):
+        """ Render the LED on image of `fluorescence` at `cycle` (batch : other channels show their dye) """
+        image = self.render_dye(fluorescence, cycle)
+        if self.batch:
+            for channel, dye in self.partners(fluorescence).items():
+                image[..., channel] = self.render_dye(dye, cycle)[..., channel]
+        self.on_image = image
+        self.fluorescence, self.cycle = fluorescence, cycle
+
+    def partners(self, fluorescence:str) -> dict:
+        """ 
+        {channel : fluorescence} of the other channels, same rank in the channel's dyes (FAM/ROX, HEX/CY5),
+        the pairs a batch shot cycle answers from one capture
+        """
+        group = lambda channel: [dye for dye in FLUORESCENCE if FLUOR_CHANNEL[dye] == channel]
+        rank = group(FLUOR_CHANNEL[fluorescence]).index(fluorescence)
+        return {channel : group(channel)[min(rank, len(group(channel)) - 1)]
+                for channel in set(FLUOR_CHANNEL.values()) if channel != FLUOR_CHANNEL[fluorescence]}
+
+    def render_dye(self, fluorescence:str, cycle:int) -> np.ndarray:
+        """ LED on image of `fluorescence` alone at `cycle` """
+        rng = np.random.default_rng([self.seed, FLUORESCENCE.index(fluorescence), cycle])
+        curve = dict(self.curves[fluorescence])
+        ct = curve.pop('ct')
+
+        # well levels with Ct jitter (well 0 : background)
+        wells = self.wells.max() + 1
+        levels = np.zeros(wells, np.float32)
+        cts = ct + np.random.default_rng([self.seed, FLUORESCENCE.index(fluorescence)]).normal(0, self.ct_spread, wells)
+        levels[1:] = [amplification(cycle, ct=well_ct, **curve) for well_ct in cts[1:]]
+
+        image = np.full(self.shape, self.dark + self.autofluorescence, np.float32)
+        image[..., FLUOR_CHANNEL[fluorescence]] += levels[self.wells]
+        image += rng.normal(0, self.pattern_noise, self.shape).astype(np.float32)
+        return image
+
+    def transition(self, now:float) -> float:
+        """ LED on ratio, exactly 0/1 once the transition is settled """
+        on, changed = bool(self.serial_task.excitation_led), self.serial_task.led_time
+        if changed is None: return float(on)
+        residual = np.exp(-(now - changed) / self.tau)
+        if residual < 1e-3: return float(on)
+        return 1 - residual if on else residual
+
+    def render(self, roi:np.ndarray):
+        ratio = self.transition(self.serial_task.now())
+        frame = self.off_image + (self.on_image - self.off_image) * ratio
+        if self.temporal_noise:
+            frame += self.rng.normal(0, self.temporal_noise, self.shape).astype(np.float32)
+        np.copyto(roi, np.clip(np.rint(frame), 0, 255), casting='unsafe')
+
+    def read(self, buffer=None):
+        self.pacer.wait()
+        if buffer is None or buffer.shape != (FRAME_HEIGHT, FRAME_WIDTH, 3) or id(buffer) not in self.canvases:
+            buffer = np.full((FRAME_HEIGHT, FRAME_WIDTH, 3), self.dark, np.uint8)
+            self.canvases.add(id(buffer))
+        y, x = self.position
+        self.render(buffer[y:y+self.shape[0], x:x+self.shape[1]])
+        self.stats['frames'] += 1
+        return True, buffer
+
+    def grab(self):
+        self.pacer.wait()
+        return True
+
+    def get_stats(self):
+        return dict(self.stats)
@@ -0,0 +1,26 @@
+from src.shot_worker import ShotWorker
+from src.common import FLUORESCENCE, BATCH_SHOT
+from emulator.serial_task import SerialEmulator
+from emulator.frames import FrameSynthesizer
+
+class PipelineEmulator(ShotWorker):
+    """ Real ShotWorker pipeline (crop, mask, intensity, archive) on synthesized frames and a fake SerialTask """
+    def __init__(self, serial_number:str, serial_task:SerialEmulator=None, seed:int=0, fps:float=15,
+                 temporal_noise:float=0.0, **kwargs):
+        serial_task = serial_task if serial_task is not None else SerialEmulator()
+        self.synthesizer = FrameSynthesizer(serial_task, fps=fps, seed=seed, temporal_noise=temporal_noise,
+                                            batch=kwargs.get('batch_shot', BATCH_SHOT))
+        ShotWorker.__init__(self, serial_number, serial_task, camera_backend=self.synthesizer, **kwargs)
+
+    def shot(self, fluor:int, cycle:int, experiment_date:str, *args, **kwargs):
+        # the device moves the filter & thermal cycles, the emulator renders the sample of the request
+        self.synthesizer.set_sample(FLUORESCENCE[fluor], cycle)
+        ShotWorker.shot(self, fluor, cycle, experiment_date, *args, **kwargs)
+
+    def shot_sequence(self, filter_indices:list, cycle:int, experiment_date:str, *args, **kwargs):
+        if filter_indices and max(filter_indices) < len(FLUORESCENCE):
+            self.synthesizer.set_sample(FLUORESCENCE[filter_indices[0]], cycle)
+        ShotWorker.shot_sequence(self, filter_indices, cycle, experiment_date, *args, **kwargs)
+
+    def set_filter(self, fluorescence:str):
+        self.synthesizer.set_sample(fluorescence, self.cycle)
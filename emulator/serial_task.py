@@ -1,3 +1,4 @@
+import time
 from enum import IntEnum
 
 class DeviceState(IntEnum):
@@ -7,16 +8,53 @@ class DeviceState(IntEnum):
     ERROR   = 0x02
 
 class SerialEmulator:
-    def __init__(self, serial_number=''):
+    """ Fake SerialTask, keeps the excitation LED state & time for the emulated camera """
+    def __init__(self, serial_number='', reference_position=(1200, 900)):
         self.state = 0
         self.serial_number =''
+        self.excitation_led = False
+        self.led_time = None
+        self.led_pwm = 250
+        self.reference_position = reference_position
+        self.error = None
+        self.stats = {'transactions' : 0}
+
+    def now(self):
+        return time.perf_counter()
 
     def set_status(self, command):
         self.state = command
         return command
+
+    def set_device_state(self, state):
+        self.state = state
+
+    def get_device_state(self):
+        return self.state
     
+    def set_excitation_led(self, state:bool):
+        self.excitation_led = state
+        self.led_time = self.now()
+        self.stats['transactions'] += 1
+
     def get_excitation_led(self):
-        return 0
+        return int(self.excitation_led)
+
+    def set_led_pwm(self, led_pwm:int):
+        self.led_pwm = led_pwm
+
+    def get_led_pwm(self):
+        return self.led_pwm
+
+    def get_reference_position(self):
+        return self.reference_position
+
+    def check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def get_stats(self):
+        return dict(self.stats)
     
     def close(self):
         return
\ No newline at end of file
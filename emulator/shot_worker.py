@@ -1,5 +1,15 @@
+import os
 import time
 import threading
+import numpy as np
+from src.logger import shot_logger
+from src.intensity import MaskIndex
+from src.settle import wait_settle
+from src.burst import BurstAccumulator
+from src.notifier import ShotNotifier
+from src.common import MASK_PATH, ROI_AREA, EXPOSURE_WAIT, SETTLE_FRAMES, SETTLE_TOLERANCE, SETTLE_MIN_TIME, SETTLE_TIMEOUT
+from src.common import BurstMethod, BURST_MAX_FRAMES, BURST_FRAME_TIMEOUT, FLUORESCENCE, MAX_SEQUENCE, ShotWorkerError
+from emulator.camera import CameraEmulator
 RFU_TABLE = [
 2,3,3,4,5,6,8,9,11,13,
 16,20,24,28,34,41,49,59,71,85,
@@ -11,34 +21,89 @@ RFU_TABLE = [
 3983,3986,3988,3990,3991,3993,3994,3995,3996,3996,
 ]
 
+# emulated shot time (seconds) when frames are not measured
+SHOT_TIME = 1.0
+# emulated capture time of every filter after the first of a shot sequence (seconds)
+FILTER_TIME = 0.1
+
 class ShotEmulator(threading.Thread):
-    def __init__(self) -> None:
+    """ Shot emulator, `time_scale` : emulated time ratio (0.001 : 2s exposure in 2ms) """
+    def __init__(self, serial_task=None, settle:bool=False, time_scale:float=1.0) -> None:
         threading.Thread.__init__(self) 
         self.daemon = True
+        self.time_scale = time_scale
+        self.stop_flag = threading.Event()
+
+        # settle & burst modes measure the RFU value from emulated camera frames
+        self.settle = settle and serial_task is not None
+        self.serial_task = serial_task
+        self.camera = CameraEmulator(serial_task, time_scale=time_scale) if serial_task is not None else None
+        if self.camera is not None:
+            mask = np.load(MASK_PATH) if os.path.exists(MASK_PATH) else np.full((ROI_AREA["height"], ROI_AREA["width"]), 255, np.uint8)
+            self.mask_index = MaskIndex(mask)
+            self.burst = BurstAccumulator(self.mask_index)
+        self.burst_frames = 0
+        self.burst_method = BurstMethod.MEAN
         
         self.running = threading.Event()
         self.running.clear()
+        self.notifier = ShotNotifier()
+        self.shot_time = 0
 
         self.shot_counter = 0
         self.filter_index = 0
         self.current_cycle = 0
         self.intensity = -1
 
+        self.sequence = None
+        self.sequence_result = None
+        self.sequence_done = threading.Event()
+
     def reset(self):
         self.running.clear()
         self.current_cycle = 0
         self.shot_counter = 0
         self.intensity = -1
 
-    def shot(self, filter_index:int, current_cycle:int, experiment_date:str):
+    def shot(self, filter_index:int, current_cycle:int, experiment_date:str, 
+             burst_frames:int=0, burst_method:int=BurstMethod.MEAN):
         self.reset()
-        self.running.set()
         self.filter_index = filter_index
         self.current_cycle = current_cycle
+        self.burst_frames = min(burst_frames, BURST_MAX_FRAMES)
+        self.burst_method = burst_method
+        self.shot_time = time.perf_counter()
+        self.sequence = None
+        self.running.set()
+
+    def shot_sequence(self, filter_indices:list, current_cycle:int, experiment_date:str, 
+                      burst_frames:int=0, burst_method:int=BurstMethod.MEAN):
+        if not 0 < len(filter_indices) <= MAX_SEQUENCE or max(filter_indices) >= len(FLUORESCENCE):
+            raise ShotWorkerError(f'Invalid shot sequence {list(filter_indices)}')
+        self.reset()
+        self.filter_index = filter_indices[0]
+        self.current_cycle = current_cycle
+        self.burst_frames = min(burst_frames, BURST_MAX_FRAMES)
+        self.burst_method = burst_method
+        self.shot_time = time.perf_counter()
+        self.sequence = list(filter_indices)
+        self.sequence_result = None
+        self.sequence_done.clear()
+        self.running.set()
+
+    def wait_sequence(self, timeout:float=None) -> dict:
+        self.sequence_done.wait(timeout)
+        if self.sequence_result is None:
+            raise ShotWorkerError('Shot sequence timeout')
+        return self.sequence_result
 
     def get_intensity(self):
         # return { 'cycle':self.current_cycle, 'fluor':self.filter_index, 'intensity':self.intensity}
         return self.intensity
+
+    def get_intensities(self):
+        # emulator has a single well
+        return [self.intensity] if self.intensity != -1 else []
     
     def get_RFU_value(self):
         col = 0
@@ -53,21 +118,87 @@ class ShotEmulator(threading.Thread):
         idx = (int)((1. + col * 0.33) * self.current_cycle)
         return RFU_TABLE[idx] if idx < 80 else RFU_TABLE[-1]
     
-    def run(self) -> None:
-        round_timer = time.perf_counter()
+    def measure_RFU_value(self):
+        """ RFU value measured from emulated camera frames (exposure ramp, noise, burst) """
+        if not self.camera.is_alive(): self.camera.start()
+        self.camera.set_active(True)
+        self.camera.bright = self.camera.dark + self.get_RFU_value() / 256
+        self.serial_task.set_excitation_led(True)
 
-        while True:
+        if self.settle:
+            settle_time, settled, _ = wait_settle(self.camera, 
+                                                  lambda frame: self.mask_index.mean(frame, 1),
+                                                  frames    = SETTLE_FRAMES,
+                                                  tolerance = SETTLE_TOLERANCE,
+                                                  min_time  = SETTLE_MIN_TIME * self.time_scale,
+                                                  timeout   = SETTLE_TIMEOUT * self.time_scale)
+            shot_logger.debug(f"emulator settle time : {settle_time:.3f}, settled : {settled}")
+        else:
+            self.stop_flag.wait(EXPOSURE_WAIT * self.time_scale)
+
+        self.burst.reset()
+        count = self.camera.frame_count
+        while self.burst.frames < max(self.burst_frames, 1):
+            count, frame = self.camera.wait_frame(count, BURST_FRAME_TIMEOUT)
+            if frame is not None: 
+                self.burst.add(frame, 1, keep=self.burst_method != BurstMethod.MEAN)
+        self.serial_task.set_excitation_led(False)
+        self.camera.set_active(False)
+        shot_logger.debug(f"emulator camera stats : {self.camera.get_stats()}")
+
+        # dark level subtraction
+        value = self.mask_index.pixel_mean(self.burst.reduce(self.burst_method)) - self.camera.dark
+        return int(value * 256)
+
+    def run_sequence(self):
+        """ Shots of the sequence filters, one exposure wait is shared when frames are not measured """
+        sequence, start_time = self.sequence, self.shot_time
+        transactions = self.serial_task.get_stats()['transactions'] if self.serial_task is not None else 0
+        intensities = []
+        for index, filter_index in enumerate(sequence):
+            self.filter_index = filter_index
+            if self.settle or self.burst_frames > 1:
+                self.intensity = self.measure_RFU_value()
+            else:
+                self.stop_flag.wait((FILTER_TIME if index else SHOT_TIME) * self.time_scale)
+                self.intensity = self.get_RFU_value()
+            intensities.append(self.intensity)
+            self.shot_counter += 1
+            self.notifier.publish(cycle=self.current_cycle, filter_index=self.filter_index, 
+                                  intensity=self.intensity, intensities=self.get_intensities(),
+                                  shot_time=time.perf_counter() - self.shot_time)
+            self.shot_time = time.perf_counter()
+
+        if self.serial_task is not None:
+            transactions = self.serial_task.get_stats()['transactions'] - transactions
+        self.sequence_result = {'intensities' : intensities, 'cycle_time' : self.shot_time - start_time,
+                                'transactions' : transactions}
+
+    def run(self) -> None:
+        while not self.stop_flag.is_set():
             self.running.wait()
-            
-            if not time.perf_counter() - round_timer > 1:
+            if self.stop_flag.is_set(): break
+
+            if self.sequence:
+                self.run_sequence()
+                self.sequence = None
+                self.running.clear()
+                self.sequence_done.set()
                 continue
-            
-            self.shot_counter += 1 
-            if self.shot_counter >= 1:
-                self.intensity = self.get_RFU_value()
-                self.running = False
-            round_timer = time.perf_counter() 
 
+            if self.settle or self.burst_frames > 1:
+                self.intensity = self.measure_RFU_value()
+            else:
+                self.stop_flag.wait(SHOT_TIME * self.time_scale)
+                self.intensity = self.get_RFU_value()
+            self.shot_counter += 1
+            self.running.clear()
+            self.notifier.publish(cycle=self.current_cycle, filter_index=self.filter_index, 
+                                  intensity=self.intensity, intensities=self.get_intensities(),
+                                  shot_time=time.perf_counter() - self.shot_time)
 
     def close(self):
-        return
\ No newline at end of file
+        self.stop_flag.set()
+        self.running.set()
+        self.sequence_done.set()
+        if self.camera is not None: self.camera.close()
\ No newline at end of file
@@ -0,0 +1,77 @@
+""" Fake Trinket M0 firmware on a pseudo terminal
+
+usage : python -m emulator.trinket [serial_number]
+
+prints the pty path, which can be opened with `SerialTask(serial_number, port=path)`.
+"""
+import os
+import pty
+import tty
+import sys
+import time
+import threading
+
+class FakeTrinket(threading.Thread):
+    """ Line based firmware commands : v, P n/p, E n/e, I n/i, m """
+    def __init__(self, serial_number:str='HelloPCR00000', reference_position=(1200, 900), latency:float=0.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.serial_number = serial_number
+        self.reference_position = reference_position
+        self.latency = latency # seconds, response delay per command
+        self.values = {'P' : 0, 'E' : 0, 'I' : 0}
+        self.commands = 0
+        self.stop_flag = False
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+    def respond(self, line:str) -> str:
+        """ Response of a command line, None for write only command """
+        self.commands += 1
+        cmd, _, value = line.partition(' ')
+        if cmd in self.values and value:
+            self.values[cmd] = int(value)
+            return None
+        if cmd.upper() in self.values:
+            return str(self.values[cmd.upper()])
+        if cmd == 'm':
+            return '%d %d' % self.reference_position
+        return None
+
+    def run(self):
+        buffer = b''
+        while not self.stop_flag:
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                break
+            buffer += data
+
+            # serial number request is a single 'v' without line ending
+            if buffer.startswith(b'v') and not buffer.startswith(b'v\r'):
+                buffer = buffer[1:]
+                os.write(self.master, f'{self.serial_number}\r\n'.encode())
+
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                line = line.decode().strip()
+                if line == 'v':
+                    res = self.serial_number
+                else:
+                    res = self.respond(line) if line else None
+                if res is None: continue
+                if self.latency: time.sleep(self.latency)
+                os.write(self.master, f'{res}\r\n'.encode())
+
+    def close(self):
+        self.stop_flag = True
+        os.close(self.master)
+        os.close(self.slave)
+
+if __name__ == '__main__':
+    trinket = FakeTrinket(*sys.argv[1:2])
+    print(trinket.port, flush=True)
+    trinket.run()
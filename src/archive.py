@@ -0,0 +1,109 @@
+import os
+import cv2
+import time
+import queue
+import threading
+import numpy as np
+from src.logger import shot_logger
+from src.stack import ImageStack
+from src.common import ARCHIVE_FORMATS, ARCHIVE_FORMAT, ARCHIVE_LEVEL, ARCHIVE_QUEUE_SIZE, ARCHIVE_FULL_POLICY
+from src.common import ShotWorkerError
+
+class ImageArchiver(threading.Thread):
+    """ Background image archive writer with bounded queue """
+    def __init__(self, format:str=ARCHIVE_FORMAT, level:int=ARCHIVE_LEVEL,
+                 queue_size:int=ARCHIVE_QUEUE_SIZE, full_policy:str=ARCHIVE_FULL_POLICY):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        if format not in ARCHIVE_FORMATS:
+            raise ShotWorkerError(f"Archive format not defined {format}")
+        if full_policy not in ('block', 'drop'):
+            raise ShotWorkerError(f"Archive full policy not defined {full_policy}")
+
+        self.format = format
+        self.level = level
+        self.full_policy = full_policy
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.made_dirs = set()
+        self.stacks = {} # {base_path : ImageStack}
+        self.stats = {'saved' : 0, 'dropped' : 0, 'errors' : 0, 'max_depth' : 0,
+                      'encode_time' : 0.0, 'max_encode_time' : 0.0}
+
+    def put(self, base_path:str, name:str, img:np.ndarray, meta:dict=None) -> bool:
+        """ 
+        Queue image to save as `base_path/name.<format>` (stack : appended to the experiment stack with `meta`),
+        the image must not be modified after
+        """
+        try:
+            self.queue.put((base_path, name, img, meta or {}), block=self.full_policy == 'block')
+        except queue.Full:
+            self.stats['dropped'] += 1
+            shot_logger.error(f"image archive queue full, dropped '{name}'")
+            return False
+        self.stats['max_depth'] = max(self.stats['max_depth'], self.queue.qsize())
+        return True
+
+    def append_stack(self, base_path:str, name:str, img:np.ndarray, meta:dict):
+        if base_path not in self.stacks:
+            self.stacks[base_path] = ImageStack(base_path)
+        self.stacks[base_path].append(img, name=name, **meta)
+
+    def write(self, path:str, img:np.ndarray):
+        if self.format == 'png':
+            ret = cv2.imwrite(path, img, [cv2.IMWRITE_PNG_COMPRESSION, self.level])
+        elif self.format == 'webp':
+            ret = cv2.imwrite(path, img, [cv2.IMWRITE_WEBP_QUALITY, 101]) # over 100 : lossless
+        else:
+            np.save(path, img)
+            ret = True
+        if not ret:
+            raise OSError(f"cannot write '{path}'")
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+
+            base_path, name, img, meta = item
+            path = os.path.join(base_path, f"{name}.{self.format}")
+            try:
+                start_time = time.perf_counter()
+                if self.format == 'stack':
+                    self.append_stack(base_path, name, img, meta)
+                else:
+                    if base_path not in self.made_dirs:
+                        os.makedirs(base_path, exist_ok=True)
+                        self.made_dirs.add(base_path)
+                    self.write(path, img)
+                encode_time = time.perf_counter() - start_time
+
+                self.stats['saved'] += 1
+                self.stats['encode_time'] += encode_time
+                self.stats['max_encode_time'] = max(self.stats['max_encode_time'], encode_time)
+                shot_logger.debug(f"saved image '{path}' {encode_time:.3f}s")
+            except Exception as e:
+                self.stats['errors'] += 1
+                shot_logger.error(f"image save error : {e}")
+                self.error = ShotWorkerError("image save error")
+            finally:
+                self.queue.task_done()
+
+    def get_stats(self):
+        """ Saved/dropped counters, queue depth and encode latency """
+        stats = dict(self.stats)
+        stats['depth'] = self.queue.qsize()
+        stats['mean_encode_time'] = stats['encode_time'] / stats['saved'] if stats['saved'] else 0.0
+        return stats
+
+    def close(self, timeout:float=None):
+        """ Flush queued images and stop """
+        if self.is_alive():
+            self.queue.put(None)
+            self.join(timeout)
+        for stack in self.stacks.values():
+            stack.close()
+        shot_logger.debug(f"image archive closed {self.get_stats()}")
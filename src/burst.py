@@ -0,0 +1,53 @@
+import numpy as np
+from src.intensity import MaskIndex
+from src.common import BurstMethod, BURST_MAX_FRAMES, BURST_CLIP_SIGMA
+
+class BurstAccumulator:
+    """
+    Accumulate the masked pixels of consecutive frames
+
+    Only the masked pixels are kept in preallocated float32 buffers, so memory
+    is bounded by BURST_MAX_FRAMES x masked pixel count.
+    """
+    def __init__(self, mask_index:MaskIndex, max_frames:int=BURST_MAX_FRAMES):
+        self.mask_index = mask_index
+        self.max_frames = max_frames
+        self.total = np.zeros(mask_index.count, np.float32)                 # running sum
+        self.stack = np.zeros((max_frames, mask_index.count), np.float32)   # for median & clipping
+        self.frames = 0
+
+    def reset(self):
+        self.total.fill(0)
+        self.frames = 0
+
+    def add(self, image:np.ndarray, channel:int, keep:bool=True):
+        """ Add masked pixels of a frame, `keep` stores the frame for median & clipping """
+        if self.frames >= self.max_frames:
+            raise ValueError(f"burst frames over {self.max_frames}")
+        if keep:
+            values = self.stack[self.frames]
+            values[:] = self.mask_index.gather(image, channel)
+            self.total += values
+        else:
+            self.total += self.mask_index.gather(image, channel)
+        self.frames += 1
+
+    def reduce(self, method:int=BurstMethod.MEAN) -> np.ndarray:
+        """ Reduce accumulated frames to one value per masked pixel """
+        if self.frames == 0:
+            raise ValueError("no frames accumulated")
+        if method == BurstMethod.MEAN:
+            return self.total / self.frames
+
+        stack = self.stack[:self.frames]
+        if method == BurstMethod.MEDIAN:
+            return np.median(stack, axis=0)
+        if method == BurstMethod.CLIPPED:
+            # sigma clipping : drop per pixel outliers over BURST_CLIP_SIGMA from the mean
+            mean = self.total / self.frames
+            limit = BURST_CLIP_SIGMA * stack.std(axis=0)
+            valid = np.abs(stack - mean) <= limit
+            count = valid.sum(axis=0)
+            clipped = np.where(valid, stack, 0).sum(axis=0) / np.maximum(count, 1)
+            return np.where(count > 0, clipped, mean)
+        raise ValueError(f"burst method {method} not defined")
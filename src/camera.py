@@ -1,15 +1,17 @@
 import cv2
+import time
 import threading
-from comtypes import COMError
-from src.dshow_cam_control.dshow_cam_ctrl import *
+import numpy as np
+from src.camera_backend import CameraBackend, DShowBackend
 from src.common import FRAME_WIDTH, FRAME_HEIGHT, EXPOSURE, FOCUS, GAIN, GAMMA, WHITEBALACE, LOW_LIGHT_COMPENSATION
+from src.common import CAMERA_IDLE_POLLING, CAMERA_IDLE_INTERVAL, CAMERA_RING_SIZE, CAMERA_RAW_CAPTURE
 from src.common import CameraNotDetectedError, CameraDisconnectedError
 from src.logger import camera_logger
 
 
 class CameraBufferCleaner(threading.Thread):
     """ Camera worker class """
-    def __init__(self, serial_number=""):
+    def __init__(self, serial_number="", backend:CameraBackend=None, raw_capture:bool=CAMERA_RAW_CAPTURE):
         threading.Thread.__init__(self) 
         self.daemon = True
 
@@ -17,27 +19,43 @@ class CameraBufferCleaner(threading.Thread):
 
         self.stop_flag = False
         self.last_frame = None
+        self.frame_count = 0
+        self.frame_cond = threading.Condition()
+
+        # Published frames are kept in a ring of preallocated buffers with capture time & sequence number,
+        # a published frame stays valid until CAMERA_RING_SIZE - 1 newer frames are captured
+        self.roi = None                     # (y, x, height, width), None : publish full frame
+        self.ring = [None] * CAMERA_RING_SIZE
+        self.timestamps = [0.0] * CAMERA_RING_SIZE
+        self.read_buffer = None
+        self.full_frame = None
+        self.full_frame_request = threading.Event()
+        self.full_frame_ready = threading.Event()
+
+        # Idle polling : drain (grab only) at low rate until set_active(True)
+        self.idle_polling = CAMERA_IDLE_POLLING
+        self.active = threading.Event()
+        self.stats = {'frames_read' : 0, 'frames_drained' : 0, 'cpu_time' : 0.0, 'run_time' : 0.0}
 
         self.serial_number = serial_number
 
-        try:
-            filters_dict = get_device_filter_dict()
+        # Raw capture : driver BGR conversion off, only the ROI is converted (see src/raw.py)
+        self.raw_capture = raw_capture
+        self.converter = None
 
-            self.cam_p_moniker  = filters_dict[self.serial_number]
-            self.cam_no         = list(filters_dict.keys()).index(self.serial_number)
+        try:
+            self.backend = backend if backend is not None else DShowBackend(self.serial_number)
         except Exception:
             camera_logger.error(f"Cannot found camera")
             raise CameraNotDetectedError()
-        
-        self.cap = cv2.VideoCapture(self.cam_no, cv2.CAP_DSHOW)
-        camera_logger.info(f"Successfully connected camera" )
+        camera_logger.info(f"Successfully connected camera {self.backend.name}")
     
     # Camera setup fuctions
     def setup_cam_all(self, focus, exposure, gain, gamma, low_light_com, white_balance):
         camera_logger.debug(f"Start setup camera")
         
         try:
-            setup_cam(self.cam_p_moniker,
+            self.backend.setup(
                     focus         = focus,
                     exposure      = exposure,
                     gain          = gain,
@@ -49,35 +67,157 @@ class CameraBufferCleaner(threading.Thread):
             self.error =  CameraDisconnectedError()
         except Exception:
             pass
-        camera_logger.debug(f"Setup done camera {get_all_settings(self.cam_p_moniker)}")
+        camera_logger.debug(f"Setup done camera {self.backend.get_all_settings()}")
 
 
     def set_focus(self, focus):
-        set_focus(self.cam_p_moniker, focus)
+        self.backend.set_focus(focus)
 
     def set_exposure(self, exposure):
-        set_exposure(self.cam_p_moniker, exposure)
+        self.backend.set_exposure(exposure)
 
     def set_lowlight_compensation(self, low_light_com):
-        set_lowlight_compensation(self.cam_p_moniker, low_light_com)
+        self.backend.set_lowlight_compensation(low_light_com)
 
     def set_whitebalance(self, white_balance):
-        set_whitebalance(self.cam_p_moniker, white_balance)
+        self.backend.set_whitebalance(white_balance)
 
     def get_all_settings(self):
-        return get_all_settings(self.cam_p_moniker)
+        return self.backend.get_all_settings()
     
+    def set_roi(self, position, size):
+        """ Publish only the ROI (position (y, x), size (height, width)) of frames, position None : full frame """
+        with self.frame_cond:
+            if position is None:
+                self.roi = None
+                self.ring = [None] * CAMERA_RING_SIZE
+            else:
+                (y, x), (height, width) = position, size
+                if y < 0 or x < 0 or y + height > FRAME_HEIGHT or x + width > FRAME_WIDTH:
+                    raise ValueError(f"ROI {size} at {position} is out of frame")
+                self.roi = (y, x, height, width)
+                self.ring = [np.empty((height, width, 3), np.uint8) for _ in range(CAMERA_RING_SIZE)]
+        camera_logger.debug(f"Publish frame ROI {self.roi}")
+
+    def set_active(self, active:bool):
+        """ Read frames at full rate while active, drain at low rate while idle """
+        if active: self.active.set()
+        else: self.active.clear()
+
+    def get_stats(self):
+        """ Frame read/drain counters and camera thread CPU usage """
+        stats = dict(self.stats)
+        stats['cpu_usage'] = stats['cpu_time'] / stats['run_time'] if stats['run_time'] else 0.0
+        return stats
+
     def get_frame(self):
+        """ Last frame, the buffer is reused after the next frame, copy it to keep """
         if self.error is not None:
             raise self.error
         return self.last_frame
+
+    def copy_frame(self, out=None, after:float=None, timeout:float=None):
+        """ 
+        Copy of the last frame, `out` : reusable destination buffer,
+        `after` : copy the first frame captured after perf_counter time `after` (waits up to `timeout`)
+        """
+        with self.frame_cond:
+            frame = self.last_frame
+            if after is not None:
+                _, frame = self.wait_frame(0, timeout, after=after)
+                if frame is None:
+                    raise CameraDisconnectedError()
+            if self.error is not None:
+                raise self.error
+            if out is None or out.shape != frame.shape:
+                return frame.copy()
+            np.copyto(out, frame)
+            return out
+
+    def get_full_frame(self, timeout=None):
+        """ Copy of a full frame for debugging and archiving, None on timeout """
+        with self.frame_cond:
+            if self.roi is None:
+                return None if self.last_frame is None else self.last_frame.copy()
+        self.full_frame_ready.clear()
+        self.full_frame_request.set()
+        if not self.full_frame_ready.wait(timeout):
+            return None
+        return self.full_frame
+
+    def publish_full_frame(self, frame):
+        self.full_frame = frame.copy()
+        self.full_frame_request.clear()
+        self.full_frame_ready.set()
+
+    def find_frame(self, count:int, after:float):
+        """ Oldest frame in the ring newer than frame number `count` and captured after `after`, (sequence, frame) """
+        for sequence in range(max(count + 1, self.frame_count - CAMERA_RING_SIZE + 2), self.frame_count + 1):
+            slot = sequence % CAMERA_RING_SIZE
+            if after is None or self.timestamps[slot] > after:
+                return sequence, self.ring[slot]
+        return count, None
+
+    def wait_frame(self, count=0, timeout=None, after:float=None):
+        """ 
+        Wait a frame newer than frame number `count` (and captured after perf_counter time `after`),
+        return (frame_count, frame), frame is None on timeout 
+        """
+        with self.frame_cond:
+            found = None
+            def ready():
+                nonlocal found
+                if self.error is not None: return True
+                found = self.find_frame(count, after)
+                return found[1] is not None
+            if not self.frame_cond.wait_for(ready, timeout):
+                return count, None
+            if self.error is not None:
+                raise self.error
+            if after is None:
+                return self.frame_count, self.last_frame
+            return found
+
+    def get_timestamp(self, sequence:int) -> float:
+        """ Capture time (perf_counter) of frame number `sequence` if it is still in the ring, else None """
+        with self.frame_cond:
+            if sequence <= self.frame_count - CAMERA_RING_SIZE + 1 or sequence > self.frame_count: 
+                return None
+            return self.timestamps[sequence % CAMERA_RING_SIZE]
         
+    def publish_bgr(self, frame, roi, ring, slot):
+        """ Copy the ROI of a BGR frame into the ring slot """
+        if self.full_frame_request.is_set():
+            self.publish_full_frame(frame)
+        if not roi:
+            ring[slot] = frame
+            return frame
+        y, x, height, width = roi
+        self.read_buffer = frame
+        if frame.shape[:2] != (height, width): # ROI sized frames (replay) are already cropped
+            frame = frame[y:y+height, x:x+width]
+        np.copyto(ring[slot], frame)
+        return ring[slot]
+
+    def publish_raw(self, raw, roi, ring, slot):
+        """ Convert the ROI of a raw frame into the ring slot """
+        self.read_buffer = raw
+        if self.full_frame_request.is_set():
+            self.publish_full_frame(self.converter.convert(raw))
+        if not roi:
+            ring[slot] = self.converter.convert(raw)
+            return ring[slot]
+        if self.converter.frame_size == roi[2:]: # ROI sized frames (replay) are already cropped
+            np.copyto(ring[slot], self.converter.convert(raw))
+            return ring[slot]
+        return self.converter.convert_roi(raw, roi, ring[slot])
+
     def run(self):
         try:
-            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
-            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
-            camera_logger.debug(f"Resolution setup done {FRAME_WIDTH}x{FRAME_HEIGHT}")
-        
+            self.backend.open()
+            if self.raw_capture:
+                self.converter = self.backend.set_raw()
+
             self.setup_cam_all(
                 focus         = FOCUS,
                 exposure      = EXPOSURE,
@@ -90,18 +230,55 @@ class CameraBufferCleaner(threading.Thread):
             self.error = Exception(f"Camera parameters setting error")
             
         camera_logger.debug("Start camera read")
+        start_time, start_cpu = time.perf_counter(), time.thread_time()
         try:
             while not self.stop_flag:
-                ret, self.last_frame = self.cap.read()    
+                self.stats['cpu_time'] = time.thread_time() - start_cpu
+                self.stats['run_time'] = time.perf_counter() - start_time
+
+                if (self.idle_polling and self.frame_count and not self.active.is_set() 
+                        and not self.full_frame_request.is_set()):
+                    # drop buffered frame without decoding
+                    if not self.backend.grab():
+                        raise CameraDisconnectedError()
+                    self.stats['frames_drained'] += 1
+                    self.active.wait(CAMERA_IDLE_INTERVAL)
+                    continue
+
+                roi, ring = self.roi, self.ring
+                slot = (self.frame_count + 1) % CAMERA_RING_SIZE
+
+                # read into reused buffers (cv2 allocates only when the size is changed)
+                if self.converter is not None:
+                    ret, frame = self.backend.read_raw(self.read_buffer)
+                else:
+                    ret, frame = self.backend.read(self.read_buffer if roi else ring[slot])
+                timestamp = time.perf_counter()
                 
                 if not ret:
                     raise CameraDisconnectedError()
+
+                if self.converter is not None:
+                    frame = self.publish_raw(frame, roi, ring, slot)
+                else:
+                    frame = self.publish_bgr(frame, roi, ring, slot)
+
+                with self.frame_cond:
+                    self.last_frame = frame
+                    self.timestamps[slot] = timestamp
+                    self.frame_count += 1
+                    self.frame_cond.notify_all()
+                self.stats['frames_read'] += 1
         except BaseException as e :
             camera_logger.error(f"Disconnected to camera")
-            self.error = CameraDisconnectedError()
+            with self.frame_cond:
+                self.error = CameraDisconnectedError()
+                self.frame_cond.notify_all()
         
     def close(self):
         camera_logger.debug(f"Start close camera thread")
+        camera_logger.debug(f"camera backend stats {self.backend.get_stats()}")
         self.stop_flag = True
-        self.cap.release()
+        self.active.set()
+        self.backend.close()
         camera_logger.debug(f"Camera close done")
\ No newline at end of file
@@ -0,0 +1,302 @@
+import os
+import re
+import cv2
+import time
+import numpy as np
+from src.stack import STACK_FILE, load_stack
+from src.raw import RawConverter, RAW_FORMATS, fourcc_name, to_raw
+from src.common import FRAME_WIDTH, FRAME_HEIGHT, REPLAY_FPS
+from src.logger import camera_logger
+
+class FramePacer:
+    """ Sleep until the next frame time at `fps`, restarts after a stall over a second """
+    def __init__(self, fps:float):
+        self.fps = fps
+        self.next_time = None
+
+    def wait(self):
+        now = time.perf_counter()
+        if self.next_time is None or now - self.next_time > 1:
+            self.next_time = now
+        elif self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time += 1 / self.fps
+
+class CameraBackend:
+    """
+    Camera device used by CameraBufferCleaner
+
+    open() : start capture, read(buffer) -> (ret, frame) : decode next frame into `buffer` if possible,
+    grab() -> ret : drop next frame, setup(...) / set_focus(...) : camera controls, close()
+    set_raw() -> RawConverter : switch to raw frames read by read_raw(buffer), None if not supported
+    `error` is the exception type of control failures (retried by ShotWorker)
+    """
+    error = OSError
+    name = ''
+
+    def open(self):
+        pass
+
+    def read(self, buffer=None):
+        raise NotImplementedError()
+
+    def grab(self) -> bool:
+        return self.read()[0]
+
+    def set_raw(self) -> RawConverter:
+        return None
+
+    def read_raw(self, buffer=None):
+        raise NotImplementedError()
+
+    def setup(self, focus, exposure, gain, gamma, low_light_com, white_balance):
+        pass
+
+    def set_focus(self, focus):
+        pass
+
+    def set_exposure(self, exposure):
+        pass
+
+    def set_lowlight_compensation(self, low_light_com):
+        pass
+
+    def set_whitebalance(self, white_balance):
+        pass
+
+    def get_all_settings(self):
+        return {}
+
+    def get_stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+class VideoCaptureBackend(CameraBackend):
+    """ cv2.VideoCapture based backend """
+    def open(self):
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+        camera_logger.debug(f"Resolution setup done {FRAME_WIDTH}x{FRAME_HEIGHT}")
+
+    def read(self, buffer=None):
+        return self.cap.read(buffer)
+
+    def grab(self):
+        return self.cap.grab()
+
+    def set_raw(self):
+        """ Turn off the driver BGR conversion when the capture format is known """
+        format = fourcc_name(self.cap.get(cv2.CAP_PROP_FOURCC))
+        if format not in RAW_FORMATS or not self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            camera_logger.info(f"raw capture not supported for format '{format}'")
+            return None
+        size = (int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        camera_logger.debug(f"raw capture {format} {size}")
+        return RawConverter(format, size)
+
+    def read_raw(self, buffer=None):
+        return self.cap.read(buffer)
+
+    def close(self):
+        self.cap.release()
+
+class DShowBackend(VideoCaptureBackend):
+    """ DirectShow capture & camera controls (Windows) """
+    name = 'dshow'
+
+    def __init__(self, serial_number:str):
+        from comtypes import COMError
+        from src.camera_control import CameraControlSession
+        from src.dshow_cam_control.dshow_cam_ctrl import DShowControlBackend
+        self.error = COMError
+        self.control = CameraControlSession(DShowControlBackend(), serial_number)
+        self.cap = cv2.VideoCapture(self.control.index, cv2.CAP_DSHOW)
+
+    def setup(self, focus, exposure, gain, gamma, low_light_com, white_balance):
+        self.control.setup(focus=focus, exposure=exposure, gain=gain, gamma=gamma,
+                           low_light_com=low_light_com, white_balance=white_balance)
+
+    def set_focus(self, focus):
+        self.control.set_focus(focus)
+
+    def set_exposure(self, exposure):
+        self.control.set_exposure(exposure)
+
+    def set_lowlight_compensation(self, low_light_com):
+        self.control.set_lowlight_compensation(low_light_com)
+
+    def set_whitebalance(self, white_balance):
+        self.control.set_whitebalance(white_balance)
+
+    def get_all_settings(self):
+        return self.control.get_all_settings()
+
+    def get_stats(self):
+        return self.control.get_stats()
+
+class OpenCVBackend(VideoCaptureBackend):
+    """ Generic OpenCV capture (V4L2 on Linux), controls through VideoCapture properties """
+    name = 'v4l2'
+    error = cv2.error
+
+    def __init__(self, device=0, api:int=None):
+        if api is None: api = cv2.CAP_V4L2 if os.name == 'posix' else cv2.CAP_ANY
+        if isinstance(device, str) and device.isdigit(): device = int(device)
+        self.cap = cv2.VideoCapture(device, api)
+        if not self.cap.isOpened():
+            raise OSError(f"cannot open camera '{device}'")
+        self.values = {} # {property : value} last set values
+
+    def set(self, property_:int, value):
+        """ Set capture property if it differs from the last set value """
+        if self.values.get(property_) == value: return
+        if not self.cap.set(property_, value):
+            camera_logger.debug(f"camera property {property_} not supported")
+        self.values[property_] = value
+
+    def setup(self, focus, exposure, gain, gamma, low_light_com, white_balance):
+        self.set(cv2.CAP_PROP_AUTOFOCUS, 0)
+        self.set_focus(focus)
+        self.set_exposure(exposure)
+        self.set(cv2.CAP_PROP_GAIN, gain)
+        self.set(cv2.CAP_PROP_GAMMA, gamma)
+        self.set_whitebalance(white_balance)
+
+    def set_focus(self, focus):
+        self.set(cv2.CAP_PROP_FOCUS, focus)
+
+    def set_exposure(self, exposure):
+        self.set(cv2.CAP_PROP_EXPOSURE, exposure)
+
+    def set_whitebalance(self, white_balance):
+        self.set(cv2.CAP_PROP_AUTO_WB, 0)
+        self.set(cv2.CAP_PROP_WB_TEMPERATURE, white_balance)
+
+    def get_all_settings(self):
+        return {
+            "focus"         : self.cap.get(cv2.CAP_PROP_FOCUS),
+            "exposure"      : self.cap.get(cv2.CAP_PROP_EXPOSURE),
+            "gain"          : self.cap.get(cv2.CAP_PROP_GAIN),
+            "gamma"         : self.cap.get(cv2.CAP_PROP_GAMMA),
+            "whilebalance"  : self.cap.get(cv2.CAP_PROP_WB_TEMPERATURE),
+        }
+
+class ReplayBackend(CameraBackend):
+    """
+    Replay recorded frames at `fps` : a video file, an image stack folder
+    or a Record/<serial>/<date> folder of {fluor}_{cycle}_{HHMMSS}.<png|webp|npy> images
+
+    `raw_format` (image sources) : frames are replayed as raw frames of a camera in that format,
+    read() converts the whole frame to BGR like the driver, read_raw() returns the raw frame after set_raw()
+    """
+    name = 'replay'
+    IMAGE_PATTERN = re.compile(r'^[A-Z0-9]+_(?P<cycle>\d+)_\d{6}\.(png|webp|npy)$')
+
+    def __init__(self, source:str, fps:float=REPLAY_FPS, loop:bool=True, raw_format:str=None):
+        self.source = source
+        self.fps = fps
+        self.loop = loop
+        self.frames, self.video = None, None
+        self.position = 0
+        self.pacer = FramePacer(fps)
+        self.stats = {'frames' : 0, 'loops' : 0}
+
+        if os.path.isfile(source):
+            self.video = cv2.VideoCapture(source)
+            if not self.video.isOpened():
+                raise OSError(f"cannot open video '{source}'")
+        elif os.path.exists(os.path.join(source, STACK_FILE)):
+            self.frames, _ = load_stack(source)
+        elif os.path.isdir(source):
+            self.frames = self.load_images(source)
+        if self.video is None and (self.frames is None or not len(self.frames)):
+            raise OSError(f"no frames to replay in '{source}'")
+
+        self.converter = None
+        if raw_format is not None:
+            if self.video is not None:
+                raise ValueError("raw replay needs an image source")
+            self.converter = RawConverter(raw_format, self.frames[0].shape[:2])
+            self.frames = [to_raw(frame, raw_format) for frame in self.frames]
+        camera_logger.debug(f"replay '{source}' at {fps} fps, raw format {raw_format}")
+
+    def load_images(self, path:str) -> list:
+        names = [name for name in os.listdir(path) if self.IMAGE_PATTERN.match(name)]
+        names.sort(key=lambda name: (os.path.getmtime(os.path.join(path, name)), name))
+        frames = []
+        for name in names:
+            name = os.path.join(path, name)
+            frame = np.load(name) if name.endswith('.npy') else cv2.imread(name, cv2.IMREAD_COLOR)
+            if frame is not None: frames.append(frame)
+        return frames
+
+    def next_frame(self):
+        if self.video is not None:
+            ret, frame = self.video.read()
+            if not ret and self.loop:
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                self.stats['loops'] += 1
+                ret, frame = self.video.read()
+            return frame if ret else None
+
+        if self.position == len(self.frames):
+            if not self.loop: return None
+            self.position = 0
+            self.stats['loops'] += 1
+        frame = self.frames[self.position]
+        self.position += 1
+        return frame
+
+    def read(self, buffer=None):
+        self.pacer.wait()
+        frame = self.next_frame()
+        if frame is None:
+            return False, None
+        self.stats['frames'] += 1
+        if self.converter is not None:
+            frame = self.converter.convert(frame) # driver conversion
+        return True, self.copy(frame, buffer)
+
+    def copy(self, frame, buffer):
+        if buffer is not None and buffer.shape == frame.shape:
+            np.copyto(buffer, frame)
+            return buffer
+        return np.array(frame)
+
+    def set_raw(self):
+        return self.converter
+
+    def read_raw(self, buffer=None):
+        self.pacer.wait()
+        frame = self.next_frame()
+        if frame is None:
+            return False, None
+        self.stats['frames'] += 1
+        return True, self.copy(frame, buffer)
+
+    def grab(self):
+        self.pacer.wait()
+        if self.next_frame() is None:
+            return False
+        self.stats['frames'] += 1
+        return True
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def close(self):
+        if self.video is not None: self.video.release()
+
+def open_backend(name:str, serial_number:str, source:str=None, fps:float=REPLAY_FPS, raw_format:str=None) -> CameraBackend:
+    """ name : one of CAMERA_BACKENDS """
+    if name == 'dshow':
+        return DShowBackend(serial_number)
+    if name == 'v4l2':
+        return OpenCVBackend(0 if source is None else source)
+    if name == 'replay':
+        if source is None:
+            raise ValueError("replay camera needs a source")
+        return ReplayBackend(source, fps, raw_format=raw_format)
+    raise ValueError(f"camera backend not defined {name}")
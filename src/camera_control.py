@@ -0,0 +1,141 @@
+import time
+import threading
+from src.logger import camera_logger
+
+# tagCameraControlProperty / tagVideoProcAmpProperty values
+CAMERA_CONTROL, VIDEO_PROC_AMP = 'camera_control', 'video_proc_amp'
+
+CameraControl_Exposure  = 4
+CameraControl_Focus     = 6
+CameraControl_LowLightCompensation = 19
+
+VideoProcAmp_Gamma          = 5
+VideoProcAmp_WhiteBalance   = 7
+VideoProcAmp_Gain           = 9
+
+# tagCameraControlFlags / tagVideoProcAmpFlags values
+Flags_Auto      = 1
+Flags_Manual    = 2
+
+class CameraControlSession:
+    """
+    Camera property control with interfaces bound once and a cache of the last set values,
+    interfaces are bound per calling thread (COM apartment)
+
+    backend : enumerate() -> {name : moniker}, bind(moniker) -> {CAMERA_CONTROL : if, VIDEO_PROC_AMP : if},
+              set(interface, property, value, flag), get(interface, property), error : COM error type
+    """
+    def __init__(self, backend, device_name:str, delay:float=0.5):
+        self.backend = backend
+        self.device_name = device_name
+        self.delay = delay # seconds, between auto/manual steps of focus & exposure
+        self.lock = threading.RLock()
+        self.values = {} # {(interface, property) : (value, flag)}
+        self.stats = {'binds' : 0, 'sets' : 0, 'skipped' : 0, 'rebinds' : 0}
+
+        self.moniker, self.index = self.find()
+        self.interfaces = {} # {thread id : interfaces}
+
+    def find(self):
+        """ Moniker & device index of `device_name` """
+        devices = self.backend.enumerate()
+        if self.device_name not in devices:
+            raise KeyError(f"camera not found '{self.device_name}'")
+        return devices[self.device_name], list(devices).index(self.device_name)
+
+    def bind(self):
+        interfaces = self.backend.bind(self.moniker)
+        self.interfaces[threading.get_ident()] = interfaces
+        self.stats['binds'] += 1
+        return interfaces
+
+    def call(self, function, interface:str, *args):
+        """ Call backend on the cached interface, rebind once on COM error """
+        with self.lock:
+            for retry in range(2):
+                try:
+                    interfaces = self.interfaces.get(threading.get_ident()) or self.bind()
+                    return function(interfaces[interface], *args)
+                except self.backend.error as error:
+                    if retry: raise
+                    camera_logger.error(f"camera control error, rebind {error}")
+                    self.stats['rebinds'] += 1
+                    self.interfaces.clear()
+                    self.values.clear() # device may be reset
+                    self.moniker, self.index = self.find()
+
+    def set(self, interface:str, property_:int, value:int, flag:int=Flags_Manual, force:bool=False) -> bool:
+        """ Set property if it differs from the last set value, return set """
+        key = (interface, property_)
+        with self.lock:
+            if not force and self.values.get(key) == (value, flag):
+                self.stats['skipped'] += 1
+                return False
+            self.call(self.backend.set, interface, property_, value, flag)
+            self.values[key] = (value, flag)
+            self.stats['sets'] += 1
+            return True
+
+    def get(self, interface:str, property_:int):
+        return self.call(self.backend.get, interface, property_)
+
+    def is_set(self, interface:str, property_:int, value:int) -> bool:
+        return self.values.get((interface, property_)) == (value, Flags_Manual)
+
+    def set_focus(self, focus:int):
+        # Need (v-1)Auto -> (v-1)Manual -> (v)Manual
+        with self.lock:
+            if self.is_set(CAMERA_CONTROL, CameraControl_Focus, focus):
+                self.stats['skipped'] += 1
+                return
+            self.set(CAMERA_CONTROL, CameraControl_Focus, focus-1, Flags_Auto, force=True)
+            time.sleep(self.delay)
+            self.set(CAMERA_CONTROL, CameraControl_Focus, focus-1, Flags_Manual, force=True)
+            time.sleep(self.delay)
+            self.set(CAMERA_CONTROL, CameraControl_Focus, focus, Flags_Manual, force=True)
+        camera_logger.debug(f"focus setting done {focus}")
+
+    def set_exposure(self, exposure:int):
+        # Need (v)Auto -> (v)Manual
+        with self.lock:
+            if self.is_set(CAMERA_CONTROL, CameraControl_Exposure, exposure):
+                self.stats['skipped'] += 1
+                return
+            self.set(CAMERA_CONTROL, CameraControl_Exposure, exposure, Flags_Auto, force=True)
+            time.sleep(self.delay)
+            self.set(CAMERA_CONTROL, CameraControl_Exposure, exposure, Flags_Manual, force=True)
+            time.sleep(self.delay)
+
+    def set_lowlight_compensation(self, low_light_com:int):
+        self.set(CAMERA_CONTROL, CameraControl_LowLightCompensation, int(low_light_com))
+
+    def set_whitebalance(self, white_balance:int):
+        self.set(VIDEO_PROC_AMP, VideoProcAmp_WhiteBalance, white_balance)
+
+    def set_gamma(self, gamma:int):
+        self.set(VIDEO_PROC_AMP, VideoProcAmp_Gamma, gamma)
+
+    def set_gain(self, gain:int):
+        self.set(VIDEO_PROC_AMP, VideoProcAmp_Gain, gain)
+
+    def setup(self, focus, exposure, gain, gamma, low_light_com, white_balance):
+        self.set_lowlight_compensation(low_light_com)
+        self.set_focus(focus)
+        self.set_exposure(exposure)
+        self.set_whitebalance(white_balance)
+        self.set_gamma(gamma)
+        self.set_gain(gain)
+
+    def get_all_settings(self):
+        return {
+            "focus"         : self.get(CAMERA_CONTROL, CameraControl_Focus),
+            "exposure"      : self.get(CAMERA_CONTROL, CameraControl_Exposure),
+            "gain"          : self.get(VIDEO_PROC_AMP, VideoProcAmp_Gain),
+            "gamma"         : self.get(VIDEO_PROC_AMP, VideoProcAmp_Gamma),
+            "whilebalance"  : self.get(VIDEO_PROC_AMP, VideoProcAmp_WhiteBalance),
+            "low_light_com" : self.get(CAMERA_CONTROL, CameraControl_LowLightCompensation),
+        }
+
+    def get_stats(self):
+        """ Interface binds, property sets done/skipped and rebinds on COM error """
+        return dict(self.stats)
@@ -9,6 +9,7 @@ class ErrorCode(IntEnum):
     CameraError     = 0x02,
     SerialError     = 0x03,
     ShotWorkerError = 0x04,
+    Busy            = 0x05, # command refused while a shot sequence runs (not kept as the server error)
     UnknownError    = 0x0F
 
 ''' Server Exceptions '''
@@ -29,6 +30,46 @@ FLUOR_CHANNEL = {
 }
 MASK_PATH = os.path.join(os.getcwd(), 'mask.npy')
 
+# Camera exposure wait after excitation LED on (seconds)
+EXPOSURE_WAIT = 2
+
+# Adaptive settle : capture as soon as SETTLE_FRAMES consecutive frames' masked mean agree within SETTLE_TOLERANCE
+SETTLE_MODE         = False
+SETTLE_FRAMES       = 3
+SETTLE_TOLERANCE    = 0.5   # 8-bit mean intensity
+SETTLE_MIN_TIME     = 0.2   # seconds, frames before are ignored
+SETTLE_TIMEOUT      = EXPOSURE_WAIT
+
+# Batch shot : one capture answers the SHOT of every channel in the same cycle
+BATCH_SHOT = False
+
+# Burst : average K consecutive frames per SHOT (K is given by the SHOT command, 0 or 1 : single frame)
+class BurstMethod(IntEnum):
+    MEAN    = 0x00,
+    MEDIAN  = 0x01,
+    CLIPPED = 0x02,  # mean after per pixel sigma clipping
+
+BURST_MAX_FRAMES = 16
+BURST_CLIP_SIGMA = 2.0
+BURST_FRAME_TIMEOUT = 1 # seconds
+
+# Image archive : background writer with bounded queue
+ARCHIVE_FORMATS     = ['png', 'webp', 'npy', 'stack'] # webp : lossless, stack : per experiment memmap stack
+ARCHIVE_FORMAT      = 'png'
+ARCHIVE_LEVEL       = 1         # png compression level (0-9)
+ARCHIVE_QUEUE_SIZE  = 16
+ARCHIVE_FULL_POLICY = 'block'   # 'block' : wait writer, 'drop' : drop image & count
+
+# Stage timings : percentiles of the last METRICS_WINDOW samples per stage (METRICS command),
+# optional JSON lines of every shot in Record/<serial>/METRICS_LOG_NAME
+METRICS_WINDOW      = 1024
+METRICS_LOG         = False
+METRICS_LOG_NAME    = 'metrics.jsonl'
+
+# Optional labeled well mask (0 : background, 1..N : well), same shape as mask.npy
+# mask.npy is used as a single well when the file does not exist
+WELL_MASK_PATH = os.path.join(os.getcwd(), 'wells.npy')
+
 class ShotWorkerError(Exception):
     def __init__(self, message):
         super().__init__(message)
@@ -43,6 +84,18 @@ VID = 0x239A
 PID = 0x801E
 
 
+# Device state cache : reads are served from cache & same value writes are skipped within timeout
+SERIAL_CACHE_TIMEOUT        = 5.0   # seconds
+SERIAL_HEARTBEAT_INTERVAL   = 2.0   # seconds, device check when no serial transaction
+
+# Serial I/O thread : response timeout & max commands written at once
+SERIAL_TIMEOUT      = 1.0   # seconds
+SERIAL_MAX_BATCH    = 8
+
+# Serial device discovery : serial number response timeout per port, last port per serial number
+SERIAL_PROBE_TIMEOUT    = 0.5   # seconds
+SERIAL_PORT_CACHE_PATH  = os.path.join(os.getcwd(), 'serial_ports.json')
+
 class DeviceState(IntEnum):
     """ Device states for control presentation LED """
     OFF     = 0x00,
@@ -78,6 +131,25 @@ ROI_AREA = {
     'height': 560,
 }
 
+# Camera thread publishes only ROI of frames (full frame is available on demand)
+ROI_CAPTURE = True
+
+# Camera thread drains frames at low rate between shots
+CAMERA_IDLE_POLLING     = True
+CAMERA_IDLE_INTERVAL    = 0.5   # seconds
+
+# Camera thread publishes frames into a ring of preallocated buffers (at least 2)
+CAMERA_RING_SIZE        = 4
+
+# Camera raw capture : driver BGR conversion off, ROI converted in the camera thread (YUY2, MJPEG, bayer)
+CAMERA_RAW_CAPTURE      = False
+RAW_FORMATS             = ['YUY2', 'MJPG', 'BGGR', 'RGGB', 'GBRG', 'GRBG']
+
+# Camera backends : DirectShow (Windows), V4L2/OpenCV generic, replay of recorded frames
+CAMERA_BACKENDS = ['dshow', 'v4l2', 'replay']
+CAMERA_BACKEND  = 'dshow'
+REPLAY_FPS      = 15
+
 class CameraNotDetectedError(Exception):
     def __init__(self):
         super().__init__("not found camera")
@@ -95,10 +167,60 @@ class Command(IntEnum):
     READY   = 0x03,
     RUN     = 0x04,
     ERROR   = 0x05,
+    STATUS_EX = 0x06,
+    PROTOCOL  = 0x07,   # filter index : requested protocol version, STATUS reply intensity : accepted version
+    SUBSCRIBE = 0x08,   # (v2) filter index : 1 subscribe, 0 unsubscribe SHOT_DONE events
+    SHOT_SEQUENCE = 0x09, # filter indices of a cycle in one request (SEQUENCE_FORMAT), replied when all are done
+    METRICS   = 0x0A,   # stage timings (METRIC_FORMAT), filter index : 1 reset after the reply
+    SHOT_DONE = 0x80,   # (v2) event pushed to subscribers, request id 0
     EXIT    = 0xFF,
 
 BUFFER_SIZE = 128
 
+# Max TCP client connections (control application + monitoring tools)
+MAX_CONNECTIONS = 4
+
+# Logging : records are queued to a background file writer (dropped & counted when the queue is full)
+LOG_QUEUED      = True
+LOG_QUEUE_SIZE  = 10000
+
+# Command packet : command, filter index, current cycle, experiment date, burst frames, burst method, reserved
+PACKET_FORMAT = '3B15s2B108s'
+
+# STATUS response : error code, intensity, error message
+STATUS_FORMAT = '=Bi100s'
+
+# STATUS_EX response : STATUS response + well count, intensity of every well (unused : -1)
+MAX_WELLS = 32
+STATUS_EX_FORMAT = '=Bi100sB%di' % MAX_WELLS
+WELLS_FORMAT = '=B%di' % MAX_WELLS
+
+# Protocol v2 (negotiated by PROTOCOL command) : length framed, request id, reply for every command,
+# several commands can be in flight per connection (replies are sent in request order)
+PROTOCOL_VERSIONS   = [1, 2]
+FRAME_HEADER_FORMAT = '=I'              # frame body length
+MAX_FRAME_SIZE      = 4096
+# request id, command, filter index, current cycle, experiment date, burst frames, burst method
+V2_REQUEST_FORMAT   = '=IBBB15sBB'
+# request id, command, error code, intensity, error message (+ STATUS_EX : WELLS_FORMAT)
+V2_RESPONSE_FORMAT  = '=IBBi100s'
+# SHOT_DONE event : V2_RESPONSE_FORMAT + cycle, filter index, shot time (seconds) + WELLS_FORMAT
+SHOT_DONE_FORMAT    = '=BBf'
+
+# SHOT_SEQUENCE : the filter indices of a cycle run back-to-back with one focus set, LED on and settle
+MAX_SEQUENCE     = 8
+SEQUENCE_TIMEOUT = 30 # seconds
+# request (v1 : reserved bytes, v2 : after V2_REQUEST_FORMAT) : count, filter indices
+SEQUENCE_FORMAT = '=B%dB' % MAX_SEQUENCE
+# reply (after STATUS_FORMAT / V2_RESPONSE_FORMAT) : count, intensity per filter index (unused : -1),
+# cycle time (seconds), serial transactions
+SEQUENCE_RESULT_FORMAT = '=B%difI' % MAX_SEQUENCE
+
+# METRICS reply (after STATUS_FORMAT / V2_RESPONSE_FORMAT, intensity : stage count) : 
+# METRIC_FORMAT per stage : name, count, p50, p95, p99, max (ms)
+METRIC_FORMAT   = '=16sIffff'
+MAX_METRICS     = 24
+
 INDICATOR = { 
     Command.OFF : DeviceState.OFF, 
     Command.READY : DeviceState.READY, 
@@ -1,4 +1,5 @@
 import time
+import threading
 
 from comtypes.gen.DirectShowLib import (
     ICreateDevEnum,
@@ -12,6 +13,7 @@ from comtypes.persist import IPropertyBag
 from comtypes import *
 
 from src.logger import camera_logger
+from src.camera_control import CAMERA_CONTROL, VIDEO_PROC_AMP
 
 
 # values for tagCameraControlFlags enum
@@ -259,4 +261,36 @@ def set_gain(p_moniker, gain):
     # Setup gain
     p_proc_amp.Set(VideoProcAmp_Gain, c_long(gain), VideoProcAmp_Flags_Manual)
 
-    hr = CoUninitialize()
\ No newline at end of file
+    hr = CoUninitialize()
+
+
+class DShowControlBackend:
+    """ DirectShow backend of src.camera_control.CameraControlSession """
+    error = COMError
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def init_thread(self):
+        """ COM is initialized once per calling thread """
+        if not getattr(self.local, 'initialized', False):
+            CoInitialize()
+            self.local.initialized = True
+
+    def enumerate(self):
+        self.init_thread()
+        return get_device_filter_dict() or {}
+
+    def bind(self, p_moniker):
+        self.init_thread()
+        p_cap = p_moniker.RemoteBindToObject(0, 0, IBaseFilter._iid_)
+        return {CAMERA_CONTROL : p_cap.QueryInterface(IAMCameraControl), 
+                VIDEO_PROC_AMP : p_cap.QueryInterface(IAMVideoProcAmp)}
+
+    def set(self, interface, property_, value, flag):
+        self.init_thread()
+        interface.Set(c_long(property_), c_long(value), c_long(flag))
+
+    def get(self, interface, property_):
+        self.init_thread()
+        return interface.Get(c_long(property_))
@@ -0,0 +1,71 @@
+import numpy as np
+
+class MaskIndex:
+    """ Precomputed pixel index of the ROI mask
+
+    The boolean comparison against the mask is done once at load time, the
+    masked pixels are then gathered with flat indices on every shot.
+    """
+    def __init__(self, mask:np.ndarray, origin:tuple=(0, 0), value:int=255):
+        self.shape = mask.shape[:2]
+        self.origin = origin # (y, x) position of the ROI in the full frame
+        self.rows, self.cols = np.nonzero(mask == value)
+        self.count = len(self.rows)
+        self._flat = {}
+
+    def flat_indices(self, shape:tuple) -> np.ndarray:
+        """ Flat indices of the masked pixels (channel 0) in a C-contiguous image of `shape`
+
+        An image with the ROI size is treated as already cropped, any other
+        size as a full frame with the ROI at `origin`.
+        """
+        shape = tuple(shape)
+        if shape not in self._flat:
+            height, width = shape[:2]
+            channels = shape[2] if len(shape) > 2 else 1
+            oy, ox = (0, 0) if (height, width) == self.shape else self.origin
+            if oy < 0 or ox < 0 or oy + self.shape[0] > height or ox + self.shape[1] > width:
+                raise ValueError(f"ROI {self.shape} at {self.origin} is out of image {shape}")
+            flat = ((self.rows + oy) * width + (self.cols + ox)) * channels
+            self._flat[shape] = flat.astype(np.intp)
+        return self._flat[shape]
+
+    def gather(self, image:np.ndarray, channel:int=0) -> np.ndarray:
+        """ Masked pixel values of one channel """
+        image = np.ascontiguousarray(image)
+        return np.take(image.reshape(-1)[channel:], self.flat_indices(image.shape))
+
+    def sum(self, image:np.ndarray, channel:int=0) -> int:
+        return int(self.gather(image, channel).sum(dtype=np.uint64))
+
+    def mean(self, image:np.ndarray, channel:int=0) -> float:
+        # integer sum is exact, so this equals np.mean(image[mask == 255])
+        return self.sum(image, channel) / self.count
+
+    def pixel_mean(self, values:np.ndarray) -> float:
+        """ Mean of gathered (or reduced) pixel values """
+        return float(np.sum(values, dtype=np.float64)) / self.count
+
+class LabelIndex(MaskIndex):
+    """ Precomputed pixel index of a labeled well mask (0 : background, 1..N : well number) """
+    def __init__(self, labels:np.ndarray, origin:tuple=(0, 0)):
+        self.shape = labels.shape[:2]
+        self.origin = origin
+        self.rows, self.cols = np.nonzero(labels)
+        self.labels = labels[self.rows, self.cols].astype(np.intp)
+        self.wells = int(self.labels.max()) if len(self.labels) else 0
+        self.counts = np.bincount(self.labels, minlength=self.wells + 1)[1:]
+        self.count = len(self.rows)
+        self._flat = {}
+
+    def means(self, image:np.ndarray, channel:int=0) -> np.ndarray:
+        """ Mean of every well in one pass """
+        return self.pixel_means(self.gather(image, channel))
+
+    def pixel_sums(self, values:np.ndarray) -> np.ndarray:
+        """ Sum of every well from gathered (or reduced) pixel values """
+        return np.bincount(self.labels, weights=values, minlength=self.wells + 1)[1:]
+
+    def pixel_means(self, values:np.ndarray) -> np.ndarray:
+        """ Mean of every well from gathered (or reduced) pixel values """
+        return self.pixel_sums(values) / self.counts
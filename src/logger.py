@@ -1,6 +1,11 @@
 import os
+import time
+import queue
+import atexit
 import datetime
 import logging
+import logging.handlers
+from src.common import LOG_QUEUED, LOG_QUEUE_SIZE
 
 # Loogers & level declares
 root_logger = logging.getLogger(name="")
@@ -23,8 +28,54 @@ server_logger.setLevel(logging.DEBUG)
 server_logger.propagate=False
 
 
+class DailyFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """ Write `prefix`-YYYYMMDD.log of the current day, switched to the next day file at midnight """
+    def __init__(self, base_path:str, prefix:str='runner'):
+        self.base_path = base_path
+        self.prefix = prefix
+        logging.handlers.TimedRotatingFileHandler.__init__(self, self.dated_path(), when='midnight', delay=True)
+
+    def dated_path(self) -> str:
+        cur_datetime = datetime.datetime.now().strftime("%Y%m%d")
+        return os.path.join(self.base_path, f"{self.prefix}-{cur_datetime}.log")
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self.baseFilename = self.dated_path()
+        self.rolloverAt = self.computeRollover(int(time.time()))
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """ Queue records to the writer thread without blocking, records are counted & dropped when the queue is full """
+    def __init__(self, queue_size:int=LOG_QUEUE_SIZE):
+        logging.handlers.QueueHandler.__init__(self, queue.Queue(maxsize=queue_size))
+        self.stats = {'queued' : 0, 'dropped' : 0, 'max_depth' : 0}
+
+    def prepare(self, record):
+        """ Merge message arguments only, records are handled by this handler alone (no copy, formatted by the writer) """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return
+        self.stats['queued'] += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], self.queue.qsize())
+
+# background log writer (set_loggers)
+log_handler:DroppingQueueHandler = None
+log_listener:logging.handlers.QueueListener = None
+
 # Add handler & formatter to logger
-def set_loggers(serial_number):
+def set_loggers(serial_number, queued:bool=LOG_QUEUED):
+    """ Log to Record/<serial>/Log/runner-YYYYMMDD.log, queued : written by a background thread """
+    global log_handler, log_listener
+
     # Set fomatter
     formatter = logging.Formatter(f"%(asctime)s\t{serial_number}\t%(name)s\t%(levelname)s\t%(message)s")
 
@@ -33,18 +84,41 @@ def set_loggers(serial_number):
     os.makedirs(base_path, exist_ok=True)
     
     # Set handler
-    cur_datetime = datetime.datetime.now().strftime("%Y%m%d")
-    log_filename = f"runner-{cur_datetime}.log"
-    log_path     = os.path.join(base_path, log_filename)
-
-    file_handler = logging.FileHandler(log_path, mode='a')
+    file_handler = DailyFileHandler(base_path)
     file_handler.setFormatter(formatter)
 
+    handler = file_handler
+    if queued:
+        log_handler = DroppingQueueHandler()
+        log_listener = logging.handlers.QueueListener(log_handler.queue, file_handler)
+        log_listener.start()
+        atexit.register(stop_loggers)
+        handler = log_handler
+
     # Attach file handler
-    root_logger.addHandler(file_handler)
-    shot_logger.addHandler(file_handler)
-    camera_logger.addHandler(file_handler)
-    serial_logger.addHandler(file_handler)
-    server_logger.addHandler(file_handler)
+    root_logger.addHandler(handler)
+    shot_logger.addHandler(handler)
+    camera_logger.addHandler(handler)
+    serial_logger.addHandler(handler)
+    server_logger.addHandler(handler)
 
-    
+def get_log_stats() -> dict:
+    """ Queued/dropped records and max queue depth of the background writer """
+    if log_handler is None: return {}
+    stats = dict(log_handler.stats)
+    stats['depth'] = log_handler.queue.qsize()
+    return stats
+
+def stop_loggers():
+    """ Write queued records and stop the background writer """
+    global log_listener
+    if log_listener is None: return
+    listener, log_listener = log_listener, None
+    listener.stop()
+    if log_handler.stats['dropped']:
+        record = logging.makeLogRecord({'name' : server_logger.name, 'levelno' : logging.WARNING, 'levelname' : 'WARNING',
+                                        'msg' : f"log queue full, dropped {log_handler.stats['dropped']} records"})
+        for handler in listener.handlers:
+            handler.handle(record)
+    for handler in listener.handlers:
+        handler.close()
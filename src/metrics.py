@@ -0,0 +1,74 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import collections
+import numpy as np
+from src.logger import shot_logger
+from src.common import METRICS_WINDOW
+
+class Metrics:
+    """ Stage latency histograms, percentiles of the last `window` samples of every stage """
+    def __init__(self, window:int=METRICS_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}   # {stage : deque of seconds}
+        self.counts = {}    # {stage : total samples}
+
+    def record(self, stage:str, seconds:float, stages:dict=None):
+        """ Add a sample, also added to `stages` {stage : seconds} of the current shot """
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = collections.deque(maxlen=self.window)
+                self.counts[stage] = 0
+            self.samples[stage].append(seconds)
+            self.counts[stage] += 1
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def span(self, stage:str, stages:dict=None):
+        """ Record the time spent in the block """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, stages)
+
+    def summary(self) -> dict:
+        """ {stage : {count, p50_ms, p95_ms, p99_ms, max_ms}} """
+        with self.lock:
+            samples = {stage : np.array(values) * 1e3 for stage, values in self.samples.items()}
+            counts = dict(self.counts)
+        summary = {}
+        for stage, values in samples.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[stage] = {'count' : counts[stage], 'p50_ms' : float(p50), 'p95_ms' : float(p95),
+                              'p99_ms' : float(p99), 'max_ms' : float(values.max())}
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.counts.clear()
+
+# process wide metrics (shot worker, serial task, command handler)
+metrics = Metrics()
+
+class MetricsLog:
+    """ Append a JSON line of stage timings per shot """
+    def __init__(self, path:str):
+        self.path = path
+        self.error = False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(self, record:dict):
+        if self.error: return
+        try:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        except OSError as e:
+            # timings are diagnostics, shots go on without the log
+            shot_logger.error(f"cannot write metrics log '{self.path}' : {e}")
+            self.error = True
@@ -0,0 +1,31 @@
+import threading
+
+class ShotNotifier:
+    """ Publish shot results to waiting subscribers with a condition variable """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.sequence = 0
+        self.result = None
+        self.wakeups = 0
+
+    def publish(self, **result):
+        """ result : cycle, filter_index, intensity, intensities, shot_time """
+        with self.cond:
+            self.sequence += 1
+            self.result = result
+            self.cond.notify_all()
+
+    def wait(self, sequence:int, timeout:float=None):
+        """ Wait a result newer than `sequence`, return (sequence, result), result is None on wake() or timeout """
+        with self.cond:
+            wakeups = self.wakeups
+            self.cond.wait_for(lambda: self.sequence > sequence or self.wakeups != wakeups, timeout)
+            if self.sequence > sequence:
+                return self.sequence, self.result
+            return sequence, None
+
+    def wake(self):
+        """ Release all waiters (unsubscribe, disconnect) """
+        with self.cond:
+            self.wakeups += 1
+            self.cond.notify_all()
@@ -0,0 +1,91 @@
+import cv2
+import numpy as np
+from src.common import RAW_FORMATS
+
+# color conversion of the 8 bit bayer patterns
+BAYER_CODES = {
+    'BGGR' : cv2.COLOR_BayerBGGR2BGR,
+    'RGGB' : cv2.COLOR_BayerRGGB2BGR,
+    'GBRG' : cv2.COLOR_BayerGBRG2BGR,
+    'GRBG' : cv2.COLOR_BayerGRBG2BGR,
+}
+
+# driver FOURCC names of the raw formats
+FOURCC_ALIASES = {'YUYV' : 'YUY2', 'BA81' : 'BGGR'}
+
+# pixels around a bayer crop, demosaic of the ROI border uses its neighbours
+BAYER_MARGIN = 2
+
+def fourcc_name(fourcc:float) -> str:
+    """ CAP_PROP_FOURCC value to a format name """
+    fourcc = int(fourcc)
+    name = ''.join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00 ')
+    return FOURCC_ALIASES.get(name, name)
+
+class RawConverter:
+    """
+    Convert raw (CAP_PROP_CONVERT_RGB off) frames to BGR, only inside the ROI when possible
+
+    YUY2 & bayer frames are cropped before the color conversion, MJPEG has to be decoded whole
+    """
+    def __init__(self, format:str, frame_size:tuple):
+        if format not in RAW_FORMATS:
+            raise ValueError(f"raw format not supported {format}")
+        self.format = format
+        self.frame_size = tuple(frame_size)
+        self.height, self.width = frame_size
+
+    def planes(self, raw:np.ndarray) -> np.ndarray:
+        """ Raw buffer as (height, width[, 2]) image, YUY2 : (height, width, 2) """
+        if self.format == 'YUY2':
+            return raw.reshape(self.height, self.width, 2)
+        return raw.reshape(self.height, self.width)
+
+    def convert(self, raw:np.ndarray) -> np.ndarray:
+        """ Full BGR frame """
+        if self.format == 'MJPG':
+            return cv2.imdecode(raw.reshape(-1), cv2.IMREAD_COLOR)
+        if self.format == 'YUY2':
+            return cv2.cvtColor(self.planes(raw), cv2.COLOR_YUV2BGR_YUY2)
+        return cv2.cvtColor(self.planes(raw), BAYER_CODES[self.format])
+
+    def convert_roi(self, raw:np.ndarray, roi:tuple, out:np.ndarray=None) -> np.ndarray:
+        """ BGR image of roi (y, x, height, width), same pixels as the ROI of convert(raw) """
+        y, x, height, width = roi
+        if self.format == 'MJPG':
+            converted, top, left = self.convert(raw), y, x
+        elif self.format == 'YUY2':
+            # macro pixels (U, V shared by 2 pixels) : even x
+            left = x % 2
+            crop = self.planes(raw)[y:y+height, x-left:x+width+(x+width)%2]
+            converted, top = cv2.cvtColor(np.ascontiguousarray(crop), cv2.COLOR_YUV2BGR_YUY2), 0
+        else:
+            # bayer cells are 2x2 : even origin, with a margin for the demosaic neighbours
+            y0 = max((y - BAYER_MARGIN) & ~1, 0)
+            x0 = max((x - BAYER_MARGIN) & ~1, 0)
+            y1 = min(y + height + BAYER_MARGIN, self.height)
+            x1 = min(x + width + BAYER_MARGIN, self.width)
+            crop = np.ascontiguousarray(self.planes(raw)[y0:y1, x0:x1])
+            converted, top, left = cv2.cvtColor(crop, BAYER_CODES[self.format]), y - y0, x - x0
+
+        converted = converted[top:top+height, left:left+width]
+        if out is None:
+            return converted.copy()
+        np.copyto(out, converted)
+        return out
+
+def to_raw(frame:np.ndarray, format:str) -> np.ndarray:
+    """ Encode a BGR frame to a raw format (replay of recorded frames) """
+    if format == 'MJPG':
+        return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].reshape(-1)
+    if format == 'YUY2':
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_YUY2)
+    if format not in BAYER_CODES:
+        raise ValueError(f"raw format not supported {format}")
+    # sample the color of every bayer cell position, pattern is the 2x2 cell in row order
+    raw = np.empty(frame.shape[:2], np.uint8)
+    channels = {'B' : 0, 'G' : 1, 'R' : 2}
+    for index, color in enumerate(format):
+        dy, dx = divmod(index, 2)
+        raw[dy::2, dx::2] = frame[dy::2, dx::2, channels[color]]
+    return raw
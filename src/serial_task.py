@@ -1,55 +1,123 @@
+import os
+import json
 import time
+import queue
 import serial
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from serial import Serial
 from serial.tools import list_ports
-from src.common import LED_PWM, VID, PID, DeviceState
+from src.common import LED_PWM, VID, PID, DeviceState, SERIAL_CACHE_TIMEOUT, SERIAL_HEARTBEAT_INTERVAL
+from src.common import SERIAL_TIMEOUT, SERIAL_MAX_BATCH, SERIAL_PROBE_TIMEOUT, SERIAL_PORT_CACHE_PATH
 from src.common import SerialNotDetectedError, SerialDisconnectedError
 from src.logger import serial_logger
+from src.metrics import metrics
+
+# posix ports are not locked on open : runners lock their port, so probes of other runners skip it
+EXCLUSIVE = True if os.name == 'posix' else None
 
 def get_valid_ports():
     """ COM port filtering using vid(0x239A) & pid(0x801E) """
-    return [port.name for port in list_ports.comports() if port.vid == VID and port.pid == PID]
+    return [port.device for port in list_ports.comports() if port.vid == VID and port.pid == PID]
+
+def probe_port(port_name:str, serial_number:str, timeout:float=SERIAL_PROBE_TIMEOUT) -> Serial:
+    """ Open port and request serial number, return opened device if matched else None """
+    try:
+        device = Serial(port_name, 9600, timeout=timeout, write_timeout=timeout, exclusive=EXCLUSIVE)
+    except serial.SerialException as e:
+        serial_logger.debug(f"{port_name} is already opened")
+        return None
+
+    try:
+        device.reset_input_buffer()
+        device.write('v'.encode())
+        val = device.readline().decode(errors='ignore').strip()
+    except serial.SerialException as e:
+        serial_logger.debug(f"{port_name} probe failed {e}")
+        val = None
+
+    if val == serial_number:
+        device.timeout = None
+        device.write_timeout = None
+        return device
+    serial_logger.debug(f"{port_name} serial number mismatch '{val}'")
+    device.close()
+    return None
+
+def load_port_cache() -> dict:
+    """ {serial number : last port} """
+    try:
+        with open(SERIAL_PORT_CACHE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_port_cache(cache:dict):
+    try:
+        with open(SERIAL_PORT_CACHE_PATH, 'w') as f:
+            json.dump(cache, f)
+    except OSError as e:
+        serial_logger.debug(f"cannot save serial port cache {e}")
 
 class SerialTask:
-    def __init__(self, serial_number:str):
+    def __init__(self, serial_number:str, port:str=None):
         self.serial_number = serial_number
-        self.device = self.get_device(serial_number)
+        self.device = Serial(port, 9600, exclusive=EXCLUSIVE) if port else self.get_device(serial_number)
         serial_logger.info(f"Successfully connected serial device")
 
+        # write-through device state cache {key : (value, updated time)}
+        self.cache = {}
+        self.error = None
+        self.stop_flag = False
+        self.last_transaction = time.perf_counter()
+        self.stats = {'transactions' : 0, 'writes' : 0, 'avoided' : 0, 'heartbeats' : 0}
+
+        # serial I/O thread owns the port, commands are queued with futures
+        self.commands = queue.Queue()
+        self.io_thread = threading.Thread(target=self.run_io, daemon=True)
+        self.io_thread.start()
+
         # initial led setttings
         self.set_led_pwm(250)
         self.set_excitation_led(False)
 
-    def get_device(self, serial_number:str):
-        device:Serial = None
-
-        # find valid port_name
-        for port_name in get_valid_ports():
-            device:Serial
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
+        self.heartbeat_thread.start()
 
-            try:
-                device = Serial(port_name, 9600)
-            except serial.SerialException as e:
-                serial_logger.debug(f"{port_name} is already opened")
-                continue
+    def get_device(self, serial_number:str):
+        """ Probe the cached port first, then all valid ports concurrently """
+        start_time = time.perf_counter()
+        cache = load_port_cache()
+        cached_port = cache.get(serial_number)
+        ports = get_valid_ports()
 
-            device.write('v'.encode())
-            while not device.in_waiting: pass
+        device = None
+        if cached_port in ports:
+            device = probe_port(cached_port, serial_number)
+            ports.remove(cached_port)
+        if device is None and ports:
+            with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+                probes = [executor.submit(probe_port, port_name, serial_number) for port_name in ports]
+                for probe in as_completed(probes):
+                    if probe.result() is None: continue
+                    if device is None: device = probe.result()
+                    else: probe.result().close()
 
-            val = device.readline().decode().strip()
-            if val == serial_number: return device
+        if device is None:
+            serial_logger.error(f"Cannot found serial deivce")
+            raise SerialNotDetectedError()
 
-            device.close()
-        
-        serial_logger.error(f"Cannot found serial deivce")
-        raise SerialNotDetectedError()
+        serial_logger.info(f"found serial device {device.port} {time.perf_counter() - start_time:.3f}s")
+        if cached_port != device.port:
+            cache[serial_number] = device.port
+            save_port_cache(cache)
+        return device
 
-    def __write(self, cmd:str, retry:int=3) -> None:
+    def __write(self, data:str, retry:int=3) -> None:
         """ Write Tx buffer """
         for count in range(retry+1):
             try:
-                cmd = cmd+'\r\n'
-                self.device.write(cmd.encode())
+                self.device.write(data.encode())
                 break # jump for-else loop
             except Exception as error:
                 self.device.reset_output_buffer() # flush output buffer
@@ -59,12 +127,20 @@ class SerialTask:
             serial_logger.error(f"serial device write function failed")
             raise SerialDisconnectedError()
 
-    def __read(self, retry:int=3) -> str:
+    def __read(self, timeout:float=SERIAL_TIMEOUT, retry:int=3) -> str:
         """ Read Rx buffer """
         for count in range(retry+1):
             try:
+                if self.device.timeout != timeout:
+                    self.device.timeout = timeout # pyserial reconfigures the port on every assignment
                 res = self.device.readline()
+                if not res.endswith(b'\n'):
+                    # no response in time, a late response would answer the next command (run_io stops)
+                    serial_logger.error(f"read timeout {timeout}s")
+                    raise SerialDisconnectedError()
                 break # jump for-else loop
+            except SerialDisconnectedError:
+                raise
             except Exception as error:
                 self.device.reset_input_buffer() # flush input buffer
                 serial_logger.error(str(error))
@@ -74,39 +150,139 @@ class SerialTask:
             raise SerialDisconnectedError()
         return res.decode().strip()
 
+    def submit(self, cmd:str, read:bool=False, timeout:float=SERIAL_TIMEOUT) -> Future:
+        """ Queue a command to the I/O thread, the future has the response (None for write only command) """
+        self.check_error()
+        future = Future()
+        self.commands.put((cmd, read, timeout, future))
+        return future
+
+    def __transaction(self, cmd:str, read:bool=False) -> str:
+        with metrics.span('serial'):
+            return self.submit(cmd, read).result()
+
+    def run_io(self):
+        """ Batch queued commands into one write, then read their responses in order """
+        try:
+            while not self.stop_flag:
+                batch = [self.commands.get()]
+                while batch[-1] is not None and len(batch) < SERIAL_MAX_BATCH:
+                    try: batch.append(self.commands.get_nowait())
+                    except queue.Empty: break
+                if batch[-1] is None: # close
+                    batch.pop()
+                    self.stop_flag = True
+
+                if not batch: continue
+                self.__write(''.join(f'{cmd}\r\n' for cmd, _, _, _ in batch))
+                self.stats['writes'] += 1
+
+                for cmd, read, timeout, future in batch:
+                    try:
+                        future.set_result(self.__read(timeout) if read else None)
+                    except Exception as error:
+                        # responses after a missing one cannot be matched to their commands
+                        future.set_exception(error)
+                        raise
+                self.stats['transactions'] += len(batch)
+                self.last_transaction = time.perf_counter()
+        except Exception as error:
+            serial_logger.error(f"serial I/O thread stopped {error}")
+            self.error = SerialDisconnectedError()
+            for _, _, _, future in batch:
+                if not future.done(): future.set_exception(self.error)
+        finally:
+            # fail commands left in queue
+            while True:
+                try: item = self.commands.get_nowait()
+                except queue.Empty: break
+                if item is not None: item[3].set_exception(self.error or SerialDisconnectedError())
+
+    def __cached(self, key:str):
+        """ Cached value within SERIAL_CACHE_TIMEOUT, None if stale """
+        value, updated = self.cache.get(key, (None, 0))
+        if time.perf_counter() - updated > SERIAL_CACHE_TIMEOUT:
+            return None
+        return value
+
+    def __update(self, key:str, value:int):
+        self.cache[key] = (value, time.perf_counter())
+
+    def __set(self, key:str, cmd:str, value:int) -> bool:
+        """ Write value if it differs from the cache, return written """
+        self.check_error()
+        if self.__cached(key) == value:
+            self.stats['avoided'] += 1
+            return False
+        self.__transaction(f'{cmd} {value}')
+        self.__update(key, value)
+        return True
+
+    def __get(self, key:str, cmd:str) -> int:
+        """ Read value from the cache, from the device if stale """
+        self.check_error()
+        value = self.__cached(key)
+        if value is not None:
+            self.stats['avoided'] += 1
+            return value
+        value = int(self.__transaction(cmd, read=True))
+        self.__update(key, value)
+        return value
+
     def set_led_pwm(self, led_pwm:int) -> None:
-        self.__write(f'P {led_pwm}')
-        serial_logger.debug(f"set LED PWM value {led_pwm}")
+        if self.__set('led_pwm', 'P', led_pwm):
+            serial_logger.debug(f"set LED PWM value {led_pwm}")
 
     def get_led_pwm(self) -> int:
-        self.__write('p')
-        res = self.__read()
-        return int(res)
+        return self.__get('led_pwm', 'p')
     
     def set_excitation_led(self, state:bool) -> None:
-        self.__write(f'E {int(state)}')
-        serial_logger.debug(f"set LED on/off {state}")
+        if self.__set('excitation_led', 'E', int(state)):
+            serial_logger.debug(f"set LED on/off {state}")
 
     def get_excitation_led(self) -> int:
-        self.__write(f'e')
-        res = self.__read()
-        return int(res)
+        return self.__get('excitation_led', 'e')
 
     def set_device_state(self, state):
-        self.__write(f'I {state}')
-        serial_logger.info(f'device state : {DeviceState(state)}')
+        if self.__set('device_state', 'I', int(state)):
+            serial_logger.info(f'device state : {DeviceState(state)}')
 
     def get_device_state(self):
-        self.__write(f'i')
-        res = self.__read()
-        return int(res)
+        return self.__get('device_state', 'i')
+
+    def heartbeat(self):
+        """ Check the device when no serial transaction is done for SERIAL_HEARTBEAT_INTERVAL """
+        while not self.stop_flag:
+            idle = time.perf_counter() - self.last_transaction
+            if idle < SERIAL_HEARTBEAT_INTERVAL:
+                time.sleep(SERIAL_HEARTBEAT_INTERVAL - idle)
+                continue
+            try:
+                self.__update('device_state', int(self.__transaction('i', read=True)))
+                self.stats['heartbeats'] += 1
+            except Exception as error:
+                if self.stop_flag: break
+                serial_logger.error(f"heartbeat failed {error}")
+                self.error = SerialDisconnectedError()
+                break
+
+    def check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def get_stats(self):
+        """ Serial transactions, transactions avoided by the cache and heartbeats """
+        return dict(self.stats)
     
     def get_reference_position(self):
         """ load heater pattern right shoulder position from arduino firmware """
-        self.__write('m')
-        res = self.__read()
+        res = self.__transaction('m', read=True)
         x,y = res.split(' ')
         return int(x), int(y)
     
     def close(self):
+        self.stop_flag = True
+        self.commands.put(None)
+        self.io_thread.join(SERIAL_TIMEOUT * SERIAL_MAX_BATCH)
+        serial_logger.debug(f"serial stats {self.get_stats()}")
         self.device.close()
\ No newline at end of file
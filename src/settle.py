@@ -0,0 +1,39 @@
+import time
+from collections import deque
+
+def wait_settle(camera, measure, frames:int, tolerance:float, min_time:float, timeout:float, floor:float=None):
+    """
+    Wait until `frames` consecutive camera frames agree within `tolerance`
+
+    Args:
+        camera : camera thread providing frame_count and wait_frame(count, timeout)
+        measure (callable): frame -> value (masked ROI mean)
+        frames (int): number of consecutive frames to agree
+        tolerance (float): max difference of the values in the window
+        min_time (float): frames captured before this time (seconds) are ignored
+        timeout (float): max wait time (seconds)
+        floor (float): level before excitation LED on, frames not above the lowest of it and the measured
+                       values + tolerance are not settled (the ramp has to rise from the dark level)
+
+    Returns:
+        tuple: (settle time, settled, frame number of the last settled frame)
+    """
+    start = time.perf_counter()
+    count = camera.frame_count
+    window = deque(maxlen=frames)
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= timeout: return elapsed, False, count
+
+        count, frame = camera.wait_frame(count, timeout - elapsed)
+        if frame is None: continue
+        if time.perf_counter() - start < min_time: continue
+
+        value = measure(frame)
+        if floor is not None: floor = min(floor, value)
+        if floor is not None and value <= floor + tolerance:
+            window.clear() # still dark, the LED ramp has not started
+            continue
+        window.append(value)
+        if len(window) == frames and max(window) - min(window) <= tolerance:
+            return time.perf_counter() - start, True, count
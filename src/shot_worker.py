@@ -4,29 +4,71 @@ import time
 import datetime
 import threading
 import numpy as np
-from comtypes import COMError
 from src.serial_task import SerialTask
 from src.camera import CameraBufferCleaner as Camera
+from src.camera_backend import CameraBackend
 from src.logger import shot_logger
-from src.common import FOCUS, ROI_AREA, MASK_PATH, FRAME_WIDTH, FRAME_HEIGHT, FLUORESCENCE, FLUOR_CHANNEL, ShotWorkerError
+from src.intensity import MaskIndex, LabelIndex
+from src.settle import wait_settle
+from src.burst import BurstAccumulator
+from src.archive import ImageArchiver
+from src.notifier import ShotNotifier
+from src.metrics import metrics, MetricsLog
+from src.common import BurstMethod, BURST_MAX_FRAMES, BURST_FRAME_TIMEOUT, MAX_SEQUENCE
+from src.common import ARCHIVE_FORMAT, EXPOSURE_WAIT, SETTLE_MODE, SETTLE_FRAMES, SETTLE_TOLERANCE, SETTLE_MIN_TIME, SETTLE_TIMEOUT
+from src.common import EXPOSURE, GAIN, GAMMA, WHITEBALACE, CAMERA_RAW_CAPTURE, METRICS_LOG, METRICS_LOG_NAME
+from src.common import FOCUS, ROI_AREA, ROI_CAPTURE, MASK_PATH, WELL_MASK_PATH, MAX_WELLS, BATCH_SHOT, FRAME_WIDTH, FRAME_HEIGHT, FLUORESCENCE, FLUOR_CHANNEL, ShotWorkerError
 
 class ShotWorker(threading.Thread):
-    def __init__(self, serial_number: str, serial_task: SerialTask):
+    def __init__(self, serial_number: str, serial_task: SerialTask, batch_shot:bool=BATCH_SHOT, 
+                 settle:bool=SETTLE_MODE, archive_format:str=ARCHIVE_FORMAT, camera_backend:CameraBackend=None,
+                 raw_capture:bool=CAMERA_RAW_CAPTURE, metrics_log:bool=METRICS_LOG):
         threading.Thread.__init__(self) 
         self.daemon:bool = True
         
         self.cycle:int = -1
         self.fluorescence:str = 'FAM'
         self.intensity:int = -1
+        self.intensities:list = []
+        self.burst_frames:int = 0
+        self.burst_method:int = BurstMethod.MEAN
         self.running:threading.Event = threading.Event()
         self.serial_number = serial_number
         self.serial_task:SerialTask = serial_task
-        self.camera:Camera = Camera(serial_number)
+        self.camera:Camera = Camera(serial_number, camera_backend, raw_capture)
+        self.archiver:ImageArchiver = ImageArchiver(format=archive_format)
+        self.notifier:ShotNotifier = ShotNotifier()
         
         self.error = None
+        self.settle:bool = settle
+        self.led_off_time:float = 0.0 # perf_counter time of the last excitation LED off, frames after are dark
+
+        # stage timings {stage : seconds} of the current shot, JSON lines log of every shot
+        self.stages:dict = {}
+        self.metrics_log = MetricsLog(os.path.join(os.getcwd(), 'Record', serial_number, METRICS_LOG_NAME)) if metrics_log else None
+
+        # batch shot : {(experiment, cycle, channel) : [(intensity, intensities, image, captured fluorescence)]}
+        # of the other channels of this cycle's captures, consumed in capture order
+        self.batch_shot:bool = batch_shot
+        self.batch_cache:dict = {}
+        self.batch_key:tuple = None
+        self.batch_lock:threading.Lock = threading.Lock()
+
+        # shot sequence : fluorescences of a cycle run in one shot, result is set when all are done
+        self.sequence:list = None
+        self.sequence_result:dict = None
+        self.sequence_done:threading.Event = threading.Event()
 
         _x, _y = self.serial_task.get_reference_position()
         self.pos_roi = (_y - ROI_AREA['dy'], _x - ROI_AREA['dx'])
+
+        # camera publishes only the ROI of frames
+        if ROI_CAPTURE:
+            try:
+                self.camera.set_roi(self.pos_roi, (ROI_AREA['height'], ROI_AREA['width']))
+            except ValueError as e:
+                shot_logger.error(f"Invalid ROI position {e}")
+                raise ShotWorkerError('Invalid ROI position')
         
 
         try:
@@ -40,106 +82,453 @@ class ShotWorker(threading.Thread):
             shot_logger.error(f"Invalid mask file")
             raise ShotWorkerError('Invalid mask file')
 
+        self.mask_index = MaskIndex(self.mask, origin=self.pos_roi)
+        if self.mask_index.count == 0:
+            shot_logger.error(f"Empty mask file")
+            raise ShotWorkerError('Invalid mask file')
+
         shot_logger.debug(f"Successfully loaded mask file {np.unique(self.mask)}, {self.mask.shape}")
 
+        self.well_index = LabelIndex(self.load_wells(), origin=self.pos_roi)
+        if self.well_index.wells > MAX_WELLS or not np.all(self.well_index.counts):
+            shot_logger.error(f"Invalid well mask file {self.well_index.counts}")
+            raise ShotWorkerError('Invalid well mask file')
+        shot_logger.debug(f"Successfully loaded well mask, wells : {self.well_index.wells}")
+
+        # wells are the mask pixels : intensity is the sum of the well sums (one gather per shot)
+        self.wells_are_mask:bool = (np.array_equal(self.mask_index.rows, self.well_index.rows) and 
+                                    np.array_equal(self.mask_index.cols, self.well_index.cols))
+
+        # burst accumulators (wells share the mask accumulator when they are the same pixels)
+        self.burst = BurstAccumulator(self.mask_index)
+        if self.wells_are_mask:
+            self.well_burst = self.burst
+        else:
+            self.well_burst = BurstAccumulator(self.well_index)
+
+    def load_wells(self):
+        """ Load labeled well mask, use mask.npy as a single well if it does not exist """
+        if not os.path.exists(WELL_MASK_PATH):
+            return (self.mask == 255).astype(np.uint8)
+        try:
+            wells = np.load(WELL_MASK_PATH)
+        except Exception as e:
+            shot_logger.error(f"Cannot loaded well mask file {e}")
+            raise ShotWorkerError("Cannot loaded well mask file")
+        if wells.shape != self.mask.shape or wells.min() < 0:
+            shot_logger.error(f"Invalid well mask file")
+            raise ShotWorkerError('Invalid well mask file')
+        return wells
+
     def run(self):
         try:
             self.running.clear()
             self.camera.start()
+            self.archiver.start()
             while True:
                 self.running.wait()
-                self.__shot()
-        except COMError as error:
+                if self.sequence: self.__shot_sequence()
+                else: self.__shot()
+        except self.camera.backend.error as error:
             shot_logger.error(error)
             self.error = ShotWorkerError(str(error))
         except BaseException as error:
             shot_logger.error(error)
             self.error = error
+        finally:
+            self.sequence_done.set() # sequence waiter checks the error
         
-    def calc_intensity(self, image):
-        image = image[:, :, FLUOR_CHANNEL[self.fluorescence]]
-        intensity = np.mean(image[self.mask == 255])
+    def calc_intensity(self, image, channel=None):
+        """ image : full frame or ROI cropped image """
+        if channel is None: channel = FLUOR_CHANNEL[self.fluorescence]
+        intensity = self.mask_index.mean(image, channel)
         return int(intensity * 256) # Normalizing intensity (change 4096 -> 65500)
+
+    def calc_intensities(self, image, channel=None):
+        """ Intensity of every well, image : full frame or ROI cropped image """
+        if channel is None: channel = FLUOR_CHANNEL[self.fluorescence]
+        intensities = self.well_index.means(image, channel)
+        return [int(intensity * 256) for intensity in intensities]
+
+    def calc_shot_intensity(self, image, channel=None):
+        """ (intensity, intensities) of one image, masked pixels are gathered once when wells are the mask """
+        if channel is None: channel = FLUOR_CHANNEL[self.fluorescence]
+        if not self.wells_are_mask:
+            return self.calc_intensity(image, channel), self.calc_intensities(image, channel)
+        sums = self.well_index.pixel_sums(self.well_index.gather(image, channel))
+        intensity = float(sums.sum()) / self.mask_index.count # integer sums, exact as MaskIndex.mean
+        return int(intensity * 256), [int(value * 256) for value in sums / self.well_index.counts]
+
+    def capture_burst(self, after:float):
+        """ Accumulate `burst_frames` consecutive frames captured after `after`, return the last frame """
+        channel = FLUOR_CHANNEL[self.fluorescence]
+        keep = self.burst_method != BurstMethod.MEAN
+        self.burst.reset()
+        if self.well_burst is not self.burst: self.well_burst.reset()
+
+        count, image = 0, None
+        while self.burst.frames < self.burst_frames:
+            timeout = max(after - time.perf_counter(), 0) + BURST_FRAME_TIMEOUT
+            count, image = self.camera.wait_frame(count, timeout, after=after)
+            if image is None:
+                raise ShotWorkerError('Burst frame timeout')
+            self.burst.add(image, channel, keep)
+            if self.well_burst is not self.burst: self.well_burst.add(image, channel, keep)
+        return image.copy()
+
+    def calc_burst_intensity(self):
+        """ (intensity, intensities) of the accumulated burst frames """
+        values = self.burst.reduce(self.burst_method)
+        intensity = int(self.mask_index.pixel_mean(values) * 256)
+        if self.well_burst is not self.burst:
+            values = self.well_burst.reduce(self.burst_method)
+        intensities = [int(value * 256) for value in self.well_index.pixel_means(values)]
+        return intensity, intensities
+
+    def crop(self, image):
+        """ Crop ROI from full frame, ROI captured image is returned as it is """
+        if image.shape[:2] == self.mask.shape:
+            return image
+        return image[self.pos_roi[0]:self.pos_roi[0]+ROI_AREA['height'], self.pos_roi[1]:self.pos_roi[1]+ROI_AREA['width']]
+
+    def cache_channels(self, image):
+        """ Keep the intensity of the other fluorescence channels of this capture for the next SHOTs of this cycle """
+        roi = self.crop(image) # archived under the cached fluorescence
+        with self.batch_lock:
+            for channel in set(FLUOR_CHANNEL.values()):
+                if channel == FLUOR_CHANNEL[self.fluorescence]: continue
+                entries = self.batch_cache.setdefault((self.experiment_date, self.cycle, channel), [])
+                entries.append((*self.calc_shot_intensity(image, channel), roi, self.fluorescence))
+
+    def pop_cached(self, experiment_date, cycle, channel):
+        """ Return cached (intensity, intensities, image, captured fluorescence) or None, each cached capture is used once per channel """
+        with self.batch_lock:
+            if self.batch_key != (experiment_date, cycle):
+                self.batch_key = (experiment_date, cycle)
+                self.batch_cache.clear()
+            entries = self.batch_cache.get((experiment_date, cycle, channel))
+            return entries.pop(0) if entries else None
     
     def get_intensity(self):
         self.check_error()
         return self.intensity
+
+    def get_intensities(self):
+        self.check_error()
+        return self.intensities
     
     def camera_set_focus(self, focus, retry=5):
         for count in range(retry + 1):
             try:
                 self.camera.set_focus(focus)
                 break
-            except COMError as error:
+            except self.camera.backend.error as error:
                 shot_logger.error(f'Camera set focus retry-{count+1}')
                 shot_logger.error(error)
         else:
             error = ShotWorkerError(f'Camera set focus retry failed')
             shot_logger.error(error)
 
+    def dark_level(self):
+        """ Masked mean of the last frame if it is captured after the last excitation LED off (settle mode), else None """
+        if not self.settle: return None
+        _, frame = self.camera.wait_frame(self.camera.frame_count - 1, 0, after=self.led_off_time)
+        return None if frame is None else self.mask_index.mean(frame, FLUOR_CHANNEL[self.fluorescence])
+
+    def wait_exposure(self, led_time:float, dark:float=None):
+        """ 
+        Wait camera's exposure after excitation LED on, return the time (perf_counter) frames are valid after 
+        (settle mode : the last settled frame is the first one after, its mean must be above `dark`)
+        """
+        if not self.settle:
+            return led_time + EXPOSURE_WAIT # the first frame captured after is waited by the camera
+
+        channel = FLUOR_CHANNEL[self.fluorescence]
+        settle_time, settled, count = wait_settle(self.camera, 
+                                                  lambda frame: self.mask_index.mean(frame, channel),
+                                                  frames    = SETTLE_FRAMES,
+                                                  tolerance = SETTLE_TOLERANCE,
+                                                  min_time  = SETTLE_MIN_TIME,
+                                                  timeout   = SETTLE_TIMEOUT,
+                                                  floor     = dark)
+        if not settled:
+            shot_logger.info(f"settle timeout {settle_time:.3f}s")
+            return time.perf_counter()
+        timestamp = self.camera.get_timestamp(count)
+        if timestamp is None: return time.perf_counter()
+        return np.nextafter(timestamp, 0.0) # frames are taken strictly after, so the settled frame is captured
+
+    def capture(self, exposed:float):
+        """ Capture frame(s) after `exposed`, set intensity of the current fluorescence, return (last frame, intensity, intensities) """
+        # grab time is counted from the end of the exposure wait
+        grab_start = max(time.perf_counter(), exposed)
+        if self.burst_frames > 1:
+            # Get images & intensity of burst frames
+            image = self.capture_burst(exposed)
+            metrics.record('grab', time.perf_counter() - grab_start, self.stages)
+            with metrics.span('intensity', self.stages):
+                intensity, intensities = self.calc_burst_intensity()
+        else:
+            # Get the first frame captured after the exposure
+            timeout = max(exposed - time.perf_counter(), 0) + BURST_FRAME_TIMEOUT
+            image = self.camera.copy_frame(after=exposed, timeout=timeout)
+            metrics.record('grab', time.perf_counter() - grab_start, self.stages)
+
+            # Get intensity (other channels are cached first, the next SHOT can follow the result)
+            with metrics.span('intensity', self.stages):
+                if self.batch_shot and self.sequence is None:
+                    self.cache_channels(image)
+                intensity, intensities = self.calc_shot_intensity(image)
+
+        # intensity is set last, the next SHOT can be sent as soon as it is visible
+        self.intensities = intensities
+        self.intensity = intensity
+        return image, intensity, intensities
+
+    def shot_state(self) -> dict:
+        """ Parameters of the current shot, kept by the worker while the handler can already start the next SHOT """
+        return {'experiment_date' : self.experiment_date,
+                'cycle'           : self.cycle,
+                'fluorescence'    : self.fluorescence,
+                'capture'         : self.fluorescence, # fluorescence of the captured image (batch shot : other one)
+                'intensity'       : -1,
+                'intensities'     : [],
+                'burst_frames'    : self.burst_frames,
+                'burst_method'    : self.burst_method}
+
+    def log_stages(self, shot_time:float, shot:dict):
+        """ Append the stage timings of the shot to the metrics log """
+        if self.metrics_log is None: return
+        self.metrics_log.write({'timestamp'    : datetime.datetime.now().isoformat(), 
+                                'experiment'   : shot['experiment_date'],
+                                'cycle'        : shot['cycle'], 
+                                'fluorescence' : shot['fluorescence'],
+                                'shot_ms'      : shot_time * 1e3,
+                                'stages_ms'    : {stage : seconds * 1e3 for stage, seconds in self.stages.items()}})
+
     def __shot(self):
         start_time = time.perf_counter()
+        shot = self.shot_state()
+        self.stages = {}
 
         # Set Camera Focus 
-        self.camera_set_focus(FOCUS)
+        with metrics.span('focus', self.stages):
+            self.camera_set_focus(FOCUS)
 
         # Set led PWM on
-        self.serial_task.set_excitation_led(True)
+        dark = self.dark_level()
+        with metrics.span('led_on', self.stages):
+            self.serial_task.set_excitation_led(True)
+        led_time = time.perf_counter()
         
-        # Wait 2 seconds because of camera's exposure
-        time.sleep(2)
+        # Wait camera's exposure (fixed 2 seconds or until frames are settled)
+        exposed = self.wait_exposure(led_time, dark)
+        settle_time = exposed - led_time
+        metrics.record('settle', settle_time, self.stages)
 
-        # Get image
-        image = self.camera.get_frame().copy()
+        # Get image & intensity
+        image, shot['intensity'], shot['intensities'] = self.capture(exposed)
 
         # Crop image
-        image = image[self.pos_roi[0]:self.pos_roi[0]+ROI_AREA['height'], self.pos_roi[1]:self.pos_roi[1]+ROI_AREA['width']]
-
-        # Get intensity
-        self.intensity = self.calc_intensity(image)
+        with metrics.span('crop', self.stages):
+            image = self.crop(image)
 
         # Set led PWM off
-        self.serial_task.set_excitation_led(False)
+        with metrics.span('led_off', self.stages):
+            self.serial_task.set_excitation_led(False)
+        self.led_off_time = time.perf_counter()
+
+        # camera drains frames at low rate until the next shot
+        self.camera.set_active(False)
         
         # running flag off:
         self.running.clear()
 
-        shot_logger.debug(f"shot spend time : {time.perf_counter()-start_time}, intensity : {self.intensity}")
+        shot_time = time.perf_counter() - start_time
+        self.publish_result(shot_time, shot)
+        metrics.record('shot', shot_time)
+
+        shot_logger.debug(f"shot spend time : {shot_time}, settle time : {settle_time:.3f}, intensity : {shot['intensity']}")
+        shot_logger.debug(f"camera stats : {self.camera.get_stats()}")
         
-        self.save_img(image)
+        with metrics.span('save', self.stages):
+            self.save_img(image, shot)
+        self.log_stages(shot_time, shot)
+
+    def __shot_sequence(self):
+        sequence = self.sequence
+        start_time = time.perf_counter()
+        shot = self.shot_state()
+        transactions = self.serial_task.get_stats()['transactions']
+        self.stages = {}
+
+        # Set Camera Focus & led PWM on once for the whole sequence
+        with metrics.span('focus', self.stages):
+            self.camera_set_focus(FOCUS)
+        dark = self.dark_level()
+        with metrics.span('led_on', self.stages):
+            self.serial_task.set_excitation_led(True)
+        led_time = time.perf_counter()
+
+        # Wait camera's exposure once, settled on the first fluorescence
+        exposed = self.wait_exposure(led_time, dark)
+        settle_time = exposed - led_time
+        metrics.record('settle', settle_time, self.stages)
+
+        intensities = []
+        for index, fluorescence in enumerate(sequence):
+            shot_start = time.perf_counter()
+            self.fluorescence = fluorescence
+            shot = dict(shot, fluorescence=fluorescence, capture=fluorescence)
+            if index:
+                with metrics.span('filter', self.stages):
+                    self.set_filter(fluorescence)
+                    exposed = self.skip_frame()
+            image, shot['intensity'], shot['intensities'] = self.capture(exposed)
+            intensities.append(shot['intensity'])
+            self.publish_result(time.perf_counter() - (start_time if index == 0 else shot_start), shot)
+            with metrics.span('crop', self.stages):
+                image = self.crop(image)
+            with metrics.span('save', self.stages):
+                self.save_img(image, shot)
+
+        with metrics.span('led_off', self.stages):
+            self.serial_task.set_excitation_led(False)
+        self.led_off_time = time.perf_counter()
+        self.camera.set_active(False)
+
+        cycle_time = time.perf_counter() - start_time
+        metrics.record('sequence', cycle_time)
+        self.log_stages(cycle_time, dict(shot, fluorescence=list(sequence)))
+        self.sequence_result = {'intensities'  : intensities, 
+                                'cycle_time'   : cycle_time,
+                                'transactions' : self.serial_task.get_stats()['transactions'] - transactions}
+        if self.sequence is sequence: self.sequence = None
+        self.running.clear()
+        self.sequence_done.set()
+
+        shot_logger.debug(f"shot sequence cycle {shot['cycle']} spend time : {cycle_time:.3f}, settle time : {settle_time:.3f}, "
+                          f"intensities : {intensities}, serial transactions : {self.sequence_result['transactions']}")
+        shot_logger.debug(f"camera stats : {self.camera.get_stats()}")
+
+    def set_filter(self, fluorescence:str):
+        """ Called before the capture of every fluorescence of a sequence but the first (emulator renders the sample) """
+        pass
+
+    def skip_frame(self) -> float:
+        """ Skip the frame in flight (exposed before the filter change), return the time next frames are valid after """
+        changed = time.perf_counter()
+        count, frame = self.camera.wait_frame(0, BURST_FRAME_TIMEOUT, after=changed)
+        if frame is None:
+            raise ShotWorkerError('Sequence frame timeout')
+        timestamp = self.camera.get_timestamp(count)
+        return timestamp if timestamp is not None else changed
+
+    def set_burst(self, burst_frames:int, burst_method:int):
+        """ Check & set burst parameters of the next shot """
+        if burst_method not in list(BurstMethod):
+            raise ShotWorkerError(f'Burst method not defined {burst_method}')
+        if burst_frames > BURST_MAX_FRAMES:
+            shot_logger.info(f"burst frames {burst_frames} limited to {BURST_MAX_FRAMES}")
+            burst_frames = BURST_MAX_FRAMES
+        self.burst_frames = burst_frames
+        self.burst_method = burst_method
+
+    def shot(self, fluor:str, cycle:int, experiment_date:str, burst_frames:int=0, burst_method:int=BurstMethod.MEAN):
+        self.set_burst(burst_frames, burst_method)
 
-    def shot(self, fluor:str, cycle:int, experiment_date:str):
         self.experiment_date = experiment_date
         self.fluorescence = FLUORESCENCE[fluor]
         self.cycle = cycle
+        self.sequence = None
 
         # reset intensity
         self.intensity = -1
+        self.intensities = []
+
+        # answer from the capture of other fluorescence in this cycle (single frame shot only)
+        if self.batch_shot and self.burst_frames <= 1:
+            cached = self.pop_cached(experiment_date, cycle, FLUOR_CHANNEL[self.fluorescence])
+            if cached is not None:
+                intensity, intensities, image, capture = cached
+                shot = dict(self.shot_state(), capture=capture, intensity=intensity, intensities=intensities)
+                self.intensities, self.intensity = intensities, intensity
+                shot_logger.debug(f"batch shot cached {self.fluorescence} cycle {cycle} from {capture}, intensity : {intensity}")
+                self.publish_result(0.0, shot)
+                self.save_img(image, shot)
+                return
+
+        # camera reads frames at full rate before excitation LED on
+        self.camera.set_active(True)
 
         # running flag on
         self.running.set()
 
-    def save_img(self, img:np.ndarray):
-        try:
-            base_path = os.path.join(os.getcwd(), 'Record', self.serial_number, self.experiment_date)
-            os.makedirs(base_path, exist_ok=True)
+    def shot_sequence(self, filter_indices:list, cycle:int, experiment_date:str, 
+                      burst_frames:int=0, burst_method:int=BurstMethod.MEAN):
+        """ Start the shots of `filter_indices` in one sequence, wait_sequence() returns the result """
+        if not 0 < len(filter_indices) <= MAX_SEQUENCE or max(filter_indices) >= len(FLUORESCENCE):
+            raise ShotWorkerError(f'Invalid shot sequence {list(filter_indices)}')
+        self.set_burst(burst_frames, burst_method)
 
-            cur_datetime = datetime.datetime.now().strftime("%H%M%S")
-            path = os.path.join(base_path, f"{self.fluorescence}_{self.cycle}_{cur_datetime}.png")
-            cv2.imwrite(path, img)
-        except Exception as e:
-            shot_logger.error(f"image save error : {e}")
-            self.error = ShotWorkerError(str("image save error"))
-        
-        shot_logger.debug(f"saved image '{path}'")
+        self.experiment_date = experiment_date
+        self.cycle = cycle
+        self.fluorescence = FLUORESCENCE[filter_indices[0]]
+        self.sequence = [FLUORESCENCE[index] for index in filter_indices]
+        self.sequence_result = None
+        self.sequence_done.clear()
+
+        # reset intensity
+        self.intensity = -1
+        self.intensities = []
+
+        self.camera.set_active(True)
+        self.running.set()
+
+    def wait_sequence(self, timeout:float=None) -> dict:
+        """ Result of the last shot sequence : intensities, cycle_time, transactions """
+        self.sequence_done.wait(timeout)
+        self.check_error()
+        if self.sequence_result is None:
+            raise ShotWorkerError('Shot sequence timeout')
+        return self.sequence_result
+
+    def publish_result(self, shot_time:float, shot:dict):
+        """ Notify SHOT_DONE subscribers of `shot` (shot_state) """
+        self.notifier.publish(cycle        = shot['cycle'], 
+                              filter_index = FLUORESCENCE.index(shot['fluorescence']),
+                              intensity    = shot['intensity'],
+                              intensities  = shot['intensities'],
+                              shot_time    = shot_time)
+
+    def save_img(self, img:np.ndarray, shot:dict):
+        """ Queue image of `shot` (shot_state) to the background archive writer """
+        base_path = os.path.join(os.getcwd(), 'Record', self.serial_number, shot['experiment_date'])
+        now = datetime.datetime.now()
+        cur_datetime = now.strftime("%H%M%S")
+        meta = {
+            'cycle'        : shot['cycle'],
+            'fluorescence' : shot['fluorescence'],
+            'capture'      : shot['capture'],
+            'timestamp'    : now.isoformat(),
+            'intensity'    : shot['intensity'],
+            'intensities'  : shot['intensities'],
+            'settings'     : {'focus' : FOCUS, 'exposure' : EXPOSURE, 'gain' : GAIN, 'gamma' : GAMMA, 
+                              'white_balance' : WHITEBALACE, 'settle' : self.settle, 
+                              'burst_frames' : shot['burst_frames'], 'burst_method' : int(shot['burst_method'])},
+        }
+        self.archiver.put(base_path, f"{shot['fluorescence']}_{shot['cycle']}_{cur_datetime}", img, meta)
     
     def check_error(self):
         if self.camera.error is not None:
             raise self.camera.error
+        if self.archiver.error is not None:
+            raise self.archiver.error
         if self.error is not None:
             raise self.error
 
     def close(self):
         shot_logger.debug(f"shot close start")
+        self.archiver.close()
         self.camera.close()
         
\ No newline at end of file
@@ -0,0 +1,78 @@
+import os
+import json
+import numpy as np
+from src.common import ROI_AREA
+
+STACK_FILE = 'images.stack'         # raw uint8 ROI images, appended in order
+INDEX_FILE = 'images.index.jsonl'   # one json line per image
+
+STACK_SHAPE = (ROI_AREA['height'], ROI_AREA['width'], 3)
+
+class ImageStack:
+    """
+    Append-only per-experiment image stack
+
+    Images are appended as raw bytes to `images.stack`, so a whole run can be
+    opened zero-copy with np.memmap (see load_stack). The sidecar index holds
+    (cycle, fluorescence, timestamp, intensity, settings) of every image.
+    """
+    def __init__(self, base_path:str, shape:tuple=STACK_SHAPE):
+        self.base_path = base_path
+        self.shape = tuple(shape)
+        os.makedirs(base_path, exist_ok=True)
+        self.count = count_stack(base_path, self.shape)
+
+        # drop a partially written image or index line of an interrupted run
+        with open(os.path.join(base_path, STACK_FILE), 'ab') as f:
+            f.truncate(self.count * int(np.prod(self.shape)))
+        lines = read_index(base_path)[:self.count]
+        with open(os.path.join(base_path, INDEX_FILE), 'w') as f:
+            f.writelines(json.dumps(line) + '\n' for line in lines)
+
+        self.stack_file = open(os.path.join(base_path, STACK_FILE), 'ab')
+        self.index_file = open(os.path.join(base_path, INDEX_FILE), 'a')
+
+    def append(self, img:np.ndarray, **meta) -> int:
+        """ Append image & its index entry, return image number """
+        if img.shape != self.shape or img.dtype != np.uint8:
+            raise ValueError(f"stack image must be uint8 {self.shape}, got {img.dtype} {img.shape}")
+        self.stack_file.write(np.ascontiguousarray(img).tobytes())
+        self.stack_file.flush()
+        self.index_file.write(json.dumps(dict(meta, index=self.count)) + '\n')
+        self.index_file.flush()
+        self.count += 1
+        return self.count - 1
+
+    def close(self):
+        self.stack_file.close()
+        self.index_file.close()
+
+def read_index(base_path:str) -> list:
+    path = os.path.join(base_path, INDEX_FILE)
+    if not os.path.exists(path): return []
+    with open(path) as f:
+        lines = []
+        for line in f:
+            try: lines.append(json.loads(line))
+            except ValueError: break # partially written line
+        return lines
+
+def count_stack(base_path:str, shape:tuple=STACK_SHAPE) -> int:
+    """ Number of complete images with index entries """
+    path = os.path.join(base_path, STACK_FILE)
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    return min(size // int(np.prod(shape)), len(read_index(base_path)))
+
+def load_stack(base_path:str, shape:tuple=STACK_SHAPE):
+    """
+    Open an experiment stack zero-copy
+
+    Returns:
+        tuple: (np.memmap (N, height, width, 3) read-only, index list)
+    """
+    count = count_stack(base_path, shape)
+    index = read_index(base_path)[:count]
+    if count == 0:
+        return np.zeros((0,) + tuple(shape), np.uint8), index
+    frames = np.memmap(os.path.join(base_path, STACK_FILE), dtype=np.uint8, mode='r', shape=(count,) + tuple(shape))
+    return frames, index
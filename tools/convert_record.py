@@ -0,0 +1,80 @@
+""" Convert Record folders of per shot images into per experiment image stacks
+
+usage : python -m tools.convert_record Record/HelloPCR12345 [-o Stack/HelloPCR12345]
+
+Every experiment folder `<date>` with `{fluor}_{cycle}_{HHMMSS}.<png|webp|npy>` images
+is converted to `<output>/<date>/images.stack` + `images.index.jsonl` (see src/stack.py).
+"""
+import os
+import re
+import cv2
+import argparse
+import datetime
+import numpy as np
+from src.intensity import MaskIndex
+from src.stack import ImageStack, STACK_FILE, load_stack
+from src.common import MASK_PATH, FLUOR_CHANNEL
+
+IMAGE_PATTERN = re.compile(r'^(?P<fluor>[A-Z0-9]+)_(?P<cycle>\d+)_(?P<time>\d{6})\.(?P<ext>png|webp|npy)$')
+
+def read_image(path:str) -> np.ndarray:
+    if path.endswith('.npy'):
+        return np.load(path)
+    return cv2.imread(path, cv2.IMREAD_COLOR)
+
+def list_images(experiment_path:str) -> list:
+    """ Images of an experiment folder in shot order """
+    images = []
+    for name in os.listdir(experiment_path):
+        match = IMAGE_PATTERN.match(name)
+        if match is None: continue
+        path = os.path.join(experiment_path, name)
+        images.append((os.path.getmtime(path), int(match['cycle']), name, match))
+    return [(name, match) for _, _, name, match in sorted(images, key=lambda image: image[:3])]
+
+def convert_experiment(experiment_path:str, output_path:str, mask_index:MaskIndex) -> int:
+    if os.path.exists(os.path.join(output_path, STACK_FILE)):
+        print(f"skip '{experiment_path}', stack already exists")
+        return 0
+
+    stack, count = None, 0
+    for name, match in list_images(experiment_path):
+        path = os.path.join(experiment_path, name)
+        img = read_image(path)
+        if img is None or img.shape[:2] != mask_index.shape:
+            print(f"skip '{path}', invalid image")
+            continue
+        if stack is None: stack = ImageStack(output_path)
+
+        fluor = match['fluor']
+        intensity = int(mask_index.mean(img, FLUOR_CHANNEL[fluor]) * 256) if fluor in FLUOR_CHANNEL else -1
+        timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+        stack.append(img, name=os.path.splitext(name)[0], cycle=int(match['cycle']), fluorescence=fluor,
+                     timestamp=timestamp, intensity=intensity, settings={'source' : name})
+        count += 1
+
+    if stack is not None: stack.close()
+    return count
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('record', type=str, help='Record/<serial> folder')
+    parser.add_argument('-o', '--output', type=str, default=None, help='output folder (default : record folder)')
+    parser.add_argument('-m', '--mask', type=str, default=MASK_PATH, help='mask file for intensity')
+    args = parser.parse_args()
+
+    output = args.output or args.record
+    mask_index = MaskIndex(np.load(args.mask))
+
+    for experiment in sorted(os.listdir(args.record)):
+        experiment_path = os.path.join(args.record, experiment)
+        if experiment == 'Log' or not os.path.isdir(experiment_path): continue
+
+        output_path = os.path.join(output, experiment)
+        count = convert_experiment(experiment_path, output_path, mask_index)
+        if count:
+            frames, _ = load_stack(output_path)
+            print(f"'{experiment_path}' -> '{output_path}' {count} images, stack {frames.shape}")
+
+if __name__ == '__main__':
+    main()